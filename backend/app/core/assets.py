@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+class AssetCache:
+    """
+    Cache de archivos JSON de prompts/ compartida por todo el proceso.
+
+    Cada entrada se revalida con un stat (mtime + tamaño), así que un archivo
+    editado se vuelve a parsear sin reiniciar. Para no tocar el disco en
+    producción se congela el PromptRegistry (PROMPTS_FROZEN), no esta cache.
+
+    Los objetos devueltos se comparten entre peticiones: no deben mutarse.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # path -> ((mtime_ns, size), data)
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Optional[Any]:
+        """Devuelve el JSON parseado de file_path, o None si no existe o es inválido."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            self._evict(file_path)
+            self.misses += 1
+            logger.warning(f"File not found: {file_path}")
+            return None
+
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(file_path)
+                self.hits += 1
+                return entry[1]
+
+        self.misses += 1
+        data = self._read(file_path)
+        if data is None:
+            return None
+
+        with self._lock:
+            self._entries[file_path] = (signature, data)
+            self._entries.move_to_end(file_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data
+
+    def _read(self, file_path: str) -> Optional[Any]:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading {file_path}: {e}")
+            return None
+
+    def _evict(self, file_path: str):
+        with self._lock:
+            self._entries.pop(file_path, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de uso de la cache."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+asset_cache = AssetCache(max_entries=int(os.getenv("PROMPTS_CACHE_MAX_ENTRIES", "256")))
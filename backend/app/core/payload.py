@@ -0,0 +1,93 @@
+import os
+import json
+from typing import Any, Dict
+import logging
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+class PayloadLimits:
+    """Tamaño máximo del body por petición (MAX_PAYLOAD_BYTES; /batch usa MAX_BATCH_PAYLOAD_BYTES)."""
+    def __init__(self):
+        self.max_bytes = int(os.getenv("MAX_PAYLOAD_BYTES", str(1024 * 1024)))
+        self.max_batch_bytes = int(os.getenv("MAX_BATCH_PAYLOAD_BYTES", str(8 * 1024 * 1024)))
+
+    def for_path(self, path: str) -> int:
+        return self.max_batch_bytes if path.endswith("/batch") else self.max_bytes
+
+payload_limits = PayloadLimits()
+
+class PayloadTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"El payload supera el límite de {limit} bytes")
+        self.limit = limit
+
+class PayloadLimitMiddleware:
+    """
+    Rechaza con 413 los bodies que superan el límite antes de parsearlos.
+
+    Si hay Content-Length se corta sin leer nada; si el body llega en chunks,
+    se cuentan los bytes a medida que se reciben y se aborta al pasarse.
+    Middleware ASGI puro para no tener que bufferizar el body.
+    """
+
+    def __init__(self, app, limits: PayloadLimits = payload_limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits.for_path(scope["path"])
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > limit
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    response = FastJSONResponse(status_code=413, content={"error": PayloadTooLarge(limit).detail})
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise PayloadTooLarge(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+async def payload_too_large_handler(request: Request, exc: PayloadTooLarge) -> JSONResponse:
+    return FastJSONResponse(status_code=413, content={"error": exc.detail})
+
+def dumps(value: Any) -> bytes:
+    """Serializa a JSON UTF-8 con orjson si está instalado."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def dumps_line(value: Dict[str, Any]) -> bytes:
+    """Una línea NDJSON."""
+    return dumps(value) + b"\n"
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa con orjson (sin indentación ni escapes ASCII)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
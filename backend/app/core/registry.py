@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from app.core.assets import asset_cache
+
+logger = logging.getLogger(__name__)
+
+Signature = Dict[str, Tuple[int, int]]
+
+class PromptRegistryError(Exception):
+    """El árbol de prompts tiene archivos inválidos o referencias rotas."""
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+class PromptSnapshot:
+    """
+    Vista completa y versionada de prompts/ en un momento dado.
+
+    Los archivos se identifican por su ruta relativa sin extensión
+    ("tasks/SCRIPT_ANALYZER", "profiles"). La versión es un hash del contenido,
+    así todos los workers con los mismos archivos reportan la misma versión.
+    No se modifica después de publicarse.
+    """
+    __slots__ = ('version', 'files', 'signature', 'templates', 'loaded_at')
+
+    def __init__(self, version: str, files: Dict[str, Any], signature: Signature):
+        self.version = version
+        self.files = files
+        self.signature = signature
+        # (category, name) -> CompiledTemplate, lo completa PromptManager al construir
+        self.templates: Dict[Tuple[str, str], Any] = {}
+        self.loaded_at = time.time()
+
+    def get(self, category: str, name: str) -> Optional[Any]:
+        return self.files.get(f"{category}/{name}" if category else name)
+
+class PromptRegistry:
+    """
+    Registro de prompts con recarga en caliente.
+
+    Carga todo el árbol en un PromptSnapshot y lo publica con una sola
+    asignación, así cada petición usa una versión consistente sin tocar disco.
+    Un watcher revisa mtimes periódicamente y solo publica un snapshot nuevo si
+    todos los JSON parsean y el callback `build` (compilación de templates y
+    verificación de referencias) no reporta errores; si falla, sigue el anterior.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        build: Callable[[PromptSnapshot], List[str]],
+        interval: float = 2.0,
+        frozen: bool = False
+    ):
+        self.root_dir = root_dir
+        self.build = build
+        self.interval = interval
+        # Frozen: se carga una vez y el watcher no arranca
+        self.frozen = frozen
+        self.reloads = 0
+        self.failures = 0
+        self.last_errors: List[str] = []
+        self._failed_signature: Optional[Signature] = None
+        self._task: Optional[asyncio.Task] = None
+        self.snapshot = self.load(strict=False)
+
+    def scan(self) -> Signature:
+        """(mtime, tamaño) de cada .json bajo el directorio raíz."""
+        signature: Signature = {}
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                rel = os.path.relpath(file_path, self.root_dir)[:-len('.json')].replace(os.sep, '/')
+                signature[rel] = (st.st_mtime_ns, st.st_size)
+        return signature
+
+    def load(self, signature: Optional[Signature] = None, strict: bool = True) -> PromptSnapshot:
+        """
+        Construye un snapshot del árbol. Con strict=True lanza PromptRegistryError
+        ante cualquier error; si no, los registra y publica lo que se pudo cargar.
+        """
+        signature = signature if signature is not None else self.scan()
+        files: Dict[str, Any] = {}
+        errors: List[str] = []
+        for rel in sorted(signature):
+            data = asset_cache.get(os.path.join(self.root_dir, *rel.split('/')) + '.json')
+            if data is None:
+                errors.append(f"{rel}.json: JSON inválido o ilegible")
+                continue
+            files[rel] = data
+
+        digest = hashlib.sha256(json.dumps(files, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        snapshot = PromptSnapshot(digest.hexdigest()[:12], files, signature)
+        errors.extend(self.build(snapshot))
+        if errors:
+            if strict:
+                raise PromptRegistryError(errors)
+            for error in errors:
+                logger.error(f"Prompt registry: {error}")
+        self.last_errors = errors
+        return snapshot
+
+    def reload(self) -> bool:
+        """Publica un snapshot nuevo si los archivos cambiaron y son válidos."""
+        signature = self.scan()
+        if signature == self.snapshot.signature or signature == self._failed_signature:
+            return False
+        try:
+            snapshot = self.load(signature)
+        except PromptRegistryError as e:
+            # Se reintenta cuando vuelvan a cambiar los archivos (p. ej. al terminar de escribirse)
+            self._failed_signature = signature
+            self.failures += 1
+            self.last_errors = e.errors
+            logger.error(f"Prompt reload rejected, keeping version {self.snapshot.version}: {e}")
+            return False
+
+        self._failed_signature = None
+        previous = self.snapshot.version
+        self.snapshot = snapshot
+        self.reloads += 1
+        logger.info(f"Prompt registry reloaded: {previous} -> {snapshot.version}")
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logger.error(f"Prompt watcher failed: {e}")
+
+    def start(self):
+        """Arranca el watcher en el event loop actual (no hace nada si está frozen)."""
+        if self.frozen or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self.watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.snapshot.version,
+            "files": len(self.snapshot.files),
+            "templates": len(self.snapshot.templates),
+            "loaded_at": round(self.snapshot.loaded_at, 3),
+            "frozen": self.frozen,
+            "watching": self._task is not None,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_errors": self.last_errors,
+        }
@@ -0,0 +1,99 @@
+import os
+import json
+import re
+from typing import List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Patrones peligrosos comunes: (nombre de la regla, regex)
+DEFAULT_RULES: List[Tuple[str, str]] = [
+    ("ignore_previous_en", r"ignore\s+(all\s+)?previous\s+instructions?"),
+    ("ignore_previous_es", r"ignora\s+(todas?\s+)?las?\s+instrucciones?\s+anteriores?"),
+    ("forget_everything_en", r"forget\s+everything"),
+    ("forget_everything_es", r"olvida\s+todo"),
+    ("new_instructions_en", r"new\s+instructions?:"),
+    ("new_instructions_es", r"nuevas?\s+instrucciones?:"),
+    ("system_role", r"system\s*:"),
+    ("assistant_role", r"assistant\s*:"),
+    ("nested_tag", r"\{\{.*?\}\}"),  # Evitar tags anidados
+]
+
+BLOCKED_MARKER = "[CONTENIDO BLOQUEADO]"
+TRUNCATED_MARKER = "\n\n[CONTENIDO TRUNCADO]"
+
+class SanitizeResult:
+    """Texto sanitizado y las reglas que se activaron."""
+    __slots__ = ('text', 'fired_rules', 'truncated')
+
+    def __init__(self, text: str, fired_rules: List[str], truncated: bool):
+        self.text = text
+        self.fired_rules = fired_rules
+        self.truncated = truncated
+
+class InjectionSanitizer:
+    """
+    Sanitizador contra prompt injection en una sola pasada.
+
+    Todas las reglas se combinan en un único regex con grupos nombrados, así
+    que el texto se recorre una vez y cada coincidencia indica qué regla la
+    produjo. El límite de longitud se aplica antes de escanear para acotar
+    el peor caso. Las reglas no deben usar grupos nombrados propios.
+    """
+
+    def __init__(self, rules: Optional[Sequence[Tuple[str, str]]] = None, max_length: int = 10000):
+        self.rules = list(rules if rules is not None else DEFAULT_RULES)
+        self.max_length = max_length
+        self._group_to_rule = {}
+        alternatives = []
+        for i, (name, pattern) in enumerate(self.rules):
+            group = f"r{i}"
+            self._group_to_rule[group] = name
+            alternatives.append(f"(?P<{group}>{pattern})")
+        self._pattern = re.compile('|'.join(alternatives), re.IGNORECASE) if alternatives else None
+
+    @classmethod
+    def from_file(cls, file_path: str, max_length: int = 10000) -> "InjectionSanitizer":
+        """Carga reglas desde un JSON: [{"name": "...", "pattern": "..."}, ...]."""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rules = [(item["name"], item["pattern"]) for item in data]
+        return cls(rules, max_length=max_length)
+
+    def sanitize(self, text: str) -> SanitizeResult:
+        """Trunca, bloquea patrones peligrosos y devuelve las reglas activadas."""
+        if not isinstance(text, str):
+            text = str(text)
+
+        # Limitar longitud antes de escanear
+        truncated = len(text) > self.max_length
+        if truncated:
+            logger.warning(f"Input truncated from {len(text)} to {self.max_length} chars")
+            text = text[:self.max_length]
+
+        fired: List[str] = []
+        if self._pattern is not None:
+            def _block(match: re.Match) -> str:
+                rule = self._group_to_rule[match.lastgroup]
+                if rule not in fired:
+                    fired.append(rule)
+                return BLOCKED_MARKER
+            text = self._pattern.sub(_block, text)
+
+        if fired:
+            logger.warning(f"Potential injection attempt detected: {', '.join(fired)}")
+        if truncated:
+            text += TRUNCATED_MARKER
+
+        return SanitizeResult(text, fired, truncated)
+
+def _build_default_sanitizer() -> InjectionSanitizer:
+    rules_file = os.getenv("SANITIZER_RULES_FILE")
+    if rules_file:
+        try:
+            return InjectionSanitizer.from_file(rules_file)
+        except Exception as e:
+            logger.error(f"Error loading sanitizer rules from {rules_file}: {e}")
+    return InjectionSanitizer()
+
+sanitizer = _build_default_sanitizer()
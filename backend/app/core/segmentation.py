@@ -0,0 +1,196 @@
+import re
+import math
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+# Cortes preferidos: fin de oración o salto de línea; luego comas/puntos y coma
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])\s+|\s*\n+\s*')
+CLAUSE_SPLIT = re.compile(r'(?<=[,;:])\s+')
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def duration_seconds(words: int, wpm: float) -> float:
+    """Misma fórmula que SCRIPT_ANALYZER: (palabras / WPM) * 60."""
+    if wpm <= 0:
+        return 0.0
+    return round(words / wpm * 60, 2)
+
+def edit_metadata(text: str, wpm: float) -> Dict[str, float]:
+    """Metadatos de edición calculados localmente para un segmento."""
+    return {"duration_seconds": duration_seconds(count_words(text), wpm), "wpm": wpm}
+
+def word_limits(min_time: float, max_time: float, wpm: float) -> Tuple[int, int]:
+    """Convierte los límites de tiempo en (mínimo, máximo) de palabras por segmento."""
+    return math.ceil(min_time * wpm / 60), max(1, math.floor(max_time * wpm / 60))
+
+def split_units(text: str, max_words: int) -> List[str]:
+    """Divide el texto en unidades que no superan max_words, cortando por oración, cláusula o palabra."""
+    units = []
+    for sentence in SENTENCE_SPLIT.split(text.strip()):
+        if not sentence:
+            continue
+        if count_words(sentence) <= max_words:
+            units.append(sentence)
+            continue
+        for clause in CLAUSE_SPLIT.split(sentence):
+            words = clause.split()
+            if len(words) <= max_words:
+                if words:
+                    units.append(clause)
+                continue
+            for i in range(0, len(words), max_words):
+                units.append(' '.join(words[i:i + max_words]))
+    return units
+
+def _words(units: List[str]) -> int:
+    return sum(count_words(u) for u in units)
+
+def pack_units(units: List[str], min_words: int, max_words: int) -> List[List[str]]:
+    """
+    Agrupa unidades en fragmentos de como máximo max_words palabras.
+
+    Un fragmento demasiado corto se une al anterior si entra en el máximo o, si
+    no, toma unidades finales del anterior.
+    """
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    current_words = 0
+    for unit in units:
+        n = count_words(unit)
+        if current and current_words + n > max_words:
+            chunks.append(current)
+            current, current_words = [], 0
+        current.append(unit)
+        current_words += n
+    if current:
+        chunks.append(current)
+
+    merged: List[List[str]] = []
+    for chunk in chunks:
+        if merged:
+            prev = merged[-1]
+            prev_words, words = _words(prev), _words(chunk)
+            if (prev_words < min_words or words < min_words) and prev_words + words <= max_words:
+                prev.extend(chunk)
+                continue
+            # Fragmento corto que no entra junto al anterior: tomar unidades finales del anterior
+            while (_words(chunk) < min_words and len(prev) > 1
+                   and _words(prev[:-1]) >= min_words
+                   and _words(chunk) + count_words(prev[-1]) <= max_words):
+                chunk.insert(0, prev.pop())
+        merged.append(chunk)
+    return merged
+
+def split_script(text: str, min_time: float, max_time: float, wpm: float) -> List[str]:
+    """
+    Segmenta un guion en fragmentos cuya duración queda dentro de [min_time, max_time].
+
+    Agrupa oraciones completas mientras no se supere max_time; una oración más
+    larga se corta por cláusulas y, como último recurso, por palabras.
+    """
+    min_words, max_words = word_limits(min_time, max_time, wpm)
+    return [' '.join(chunk) for chunk in pack_units(split_units(text, max_words), min_words, max_words)]
+
+def plan_incremental(
+    old_chunks: List[List[str]],
+    new_units: List[str],
+    min_words: int,
+    max_words: int
+) -> List[Tuple[List[str], Optional[int]]]:
+    """
+    Compara las unidades de un guion editado con los fragmentos de la versión anterior.
+
+    Devuelve la nueva lista de fragmentos como (unidades, índice del fragmento
+    anterior reutilizado o None si hay que analizarlo de nuevo). Un fragmento
+    anterior se reutiliza solo si todas sus unidades siguen presentes, contiguas
+    y sin cambios; las regiones editadas se vuelven a segmentar localmente.
+    """
+    old_units = [unit for chunk in old_chunks for unit in chunk]
+    matcher = SequenceMatcher(None, old_units, new_units, autojunk=False)
+    mapping: Dict[int, int] = {}
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            mapping[a + k] = b + k
+
+    # Posición en el guion nuevo donde empieza cada fragmento intacto
+    starts: Dict[int, int] = {}
+    pos = 0
+    for ci, chunk in enumerate(old_chunks):
+        mapped = [mapping.get(i) for i in range(pos, pos + len(chunk))]
+        pos += len(chunk)
+        if mapped and None not in mapped and mapped == list(range(mapped[0], mapped[0] + len(chunk))):
+            starts[mapped[0]] = ci
+
+    items: List[Tuple[List[str], Optional[int]]] = []
+    region: List[str] = []
+    j = 0
+    while j < len(new_units):
+        if j in starts:
+            if region:
+                items.append((region, None))
+                region = []
+            ci = starts[j]
+            items.append((list(old_chunks[ci]), ci))
+            j += len(old_chunks[ci])
+        else:
+            region.append(new_units[j])
+            j += 1
+    if region:
+        items.append((region, None))
+
+    # Una región editada demasiado corta absorbe al fragmento vecino
+    i = 0
+    while i < len(items):
+        units, ci = items[i]
+        if ci is None and _words(units) < min_words and len(items) > 1:
+            if i + 1 < len(items):
+                items[i:i + 2] = [(units + items[i + 1][0], None)]
+            else:
+                items[i - 1:i + 1] = [(items[i - 1][0] + units, None)]
+                i -= 1
+            continue
+        i += 1
+
+    plan: List[Tuple[List[str], Optional[int]]] = []
+    for units, ci in items:
+        if ci is None:
+            plan.extend((chunk, None) for chunk in pack_units(units, min_words, max_words))
+        else:
+            plan.append((units, ci))
+    return plan
+
+def default_segment_type(index: int, total: int) -> str:
+    if index == 0:
+        return "hook"
+    if index == total - 1 and total > 1:
+        return "cta"
+    return "development"
+
+def build_analysis(chunks: List[str], directions: List[Dict[str, Any]], wpm: float, language: str) -> Dict[str, Any]:
+    """
+    Arma un resultado compatible con SCRIPT_ANALYSIS a partir de los fragmentos
+    locales y la dirección generada por el modelo para cada uno.
+
+    El texto, los ids y los tiempos salen siempre del cálculo local; del modelo
+    solo se toman tipo, dirección y subtítulos (con valores por defecto si falta).
+    """
+    segments = []
+    for i, (text, direction) in enumerate(zip(chunks, directions)):
+        direction = direction or {}
+        segments.append({
+            "id": i + 1,
+            "type": direction.get("type") or default_segment_type(i, len(chunks)),
+            "text": text,
+            "direction": direction.get("direction") or {"tone": "natural", "pauses": "", "emphasis": ""},
+            "subtitles": direction.get("subtitles") or text,
+            "edit_metadata": edit_metadata(text, wpm),
+        })
+    return {
+        "meta": {
+            "language": language,
+            "total_segments": len(segments),
+            "estimated_duration_seconds": max(1, round(sum(s["edit_metadata"]["duration_seconds"] for s in segments), 2)),
+        },
+        "segments": segments,
+    }
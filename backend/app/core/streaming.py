@@ -0,0 +1,75 @@
+import json
+from typing import Any, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SegmentStreamParser:
+    """
+    Parser incremental que extrae los objetos de un array JSON a medida que llegan.
+
+    Recibe fragmentos de texto (tokens del proveedor) y devuelve cada elemento
+    de `array_key` en cuanto su objeto se cierra, sin esperar al JSON completo.
+    Solo reconoce el array cuando es una clave del objeto raíz.
+    """
+
+    def __init__(self, array_key: str = "segments"):
+        self.array_key = array_key
+        self._text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: Optional[str] = None
+        self._in_array = False
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Agrega texto y devuelve los elementos que quedaron completos."""
+        self._text += chunk
+        items = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in '{[':
+                if (ch == '[' and len(self._stack) == 1 and self._stack[0] == '{'
+                        and self._last_string == self.array_key):
+                    self._in_array = True
+                elif ch == '{' and self._in_array and len(self._stack) == 2:
+                    self._item_start = i
+                self._stack.append(ch)
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if self._in_array and ch == '}' and len(self._stack) == 2 and self._item_start >= 0:
+                    try:
+                        items.append(json.loads(text[self._item_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Incomplete streamed item skipped: {e}")
+                    self._item_start = -1
+                elif self._in_array and ch == ']' and len(self._stack) == 1:
+                    self._in_array = False
+            elif ch == ',' and len(self._stack) == 1:
+                self._last_string = None
+        self._pos = len(text)
+        return items
+
+    @property
+    def text(self) -> str:
+        """Texto completo recibido hasta el momento."""
+        return self._text
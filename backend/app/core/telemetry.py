@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import time
+import queue
+import random
+import logging
+import logging.handlers
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Buckets en segundos: cubren desde el render (~ms) hasta llamadas LLM largas
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+    """
+    Registro de métricas en memoria con salida en formato de texto Prometheus.
+
+    Contadores e histogramas con labels; los valores instantáneos (tamaño de
+    caches, peticiones en vuelo) se obtienen con collectors al momento del scrape.
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], List[Tuple[str, Dict[str, str], float]]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(DEFAULT_BUCKETS)
+        histogram.observe(value)
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def register_collector(self, collector: Callable[[], List[Tuple[str, Dict[str, str], float]]]):
+        """Agrega una función que devuelve gauges (nombre, labels, valor) en cada scrape."""
+        self._collectors.append(collector)
+
+    def _labels(self, key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, series in self._counters.items():
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{self._labels(key)} {value}")
+
+        for name, series in self._histograms.items():
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in series.items():
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(key, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(key, ('le', '+Inf'))} {h.count}")
+                lines.append(f"{name}_sum{self._labels(key)} {h.total}")
+                lines.append(f"{name}_count{self._labels(key)} {h.count}")
+
+        gauges: Dict[str, List[str]] = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+                    gauges.setdefault(name, []).append(f"{name}{self._labels(key)} {value}")
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe("vrm_stage_seconds", "Duración por etapa de la petición (resolve, sanitize, queue_wait, upstream, validation, serialization).")
+metrics.describe("vrm_http_requests_total", "Peticiones HTTP por ruta y estado.")
+metrics.describe("vrm_response_cache_total", "Consultas a la cache de respuestas de IA.")
+metrics.describe("vrm_validation_failures_total", "Respuestas de IA que no pasaron la validación.")
+metrics.describe("vrm_provider_errors_total", "Errores de proveedores de IA.")
+
+class Trace:
+    """Tiempos acumulados por etapa de una petición."""
+    __slots__ = ('spans', 'start')
+
+    def __init__(self):
+        self.spans: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def as_millis(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()}
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("vrm_trace", default=None)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Mide una etapa: suma al trace actual y al histograma vrm_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, elapsed)
+        metrics.observe("vrm_stage_seconds", elapsed, stage=name)
+
+# --- Logging estructurado ---
+
+REDACTIONS = [
+    (re.compile(r'sk-[A-Za-z0-9_\-]{8,}'), 'sk-***'),
+    (re.compile(r'(?i)bearer\s+[A-Za-z0-9._\-]+'), 'Bearer ***'),
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '***@***'),
+]
+
+def redact(text: str, max_length: int = 2000) -> str:
+    """Oculta credenciales y emails y recorta el texto para logs."""
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    if len(text) > max_length:
+        text = text[:max_length] + f"...[+{len(text) - max_length} chars]"
+    return text
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos extra van en record.fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LoggingConfig:
+    def __init__(self):
+        self.level = os.getenv("LOG_LEVEL", "INFO").upper()
+        self.sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+        self.log_content = os.getenv("LOG_PROMPT_CONTENT", "").lower() in ("1", "true", "yes")
+
+log_config = LoggingConfig()
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_pid: Optional[int] = None
+
+def setup_logging():
+    """
+    Logging JSON asíncrono: los handlers escriben desde un hilo aparte vía
+    QueueHandler/QueueListener, así el event loop nunca bloquea en stdout.
+    """
+    global _listener, _listener_pid
+    # El hilo del listener no sobrevive a un fork: cada worker crea el suyo
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=10000)
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+    root = logging.getLogger()
+    root.handlers = [_DroppingQueueHandler(log_queue)]
+    root.setLevel(log_config.level)
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta registros si la cola está llena en vez de bloquear."""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def sampled() -> bool:
+    """True para la fracción LOG_SAMPLE_RATE de las peticiones."""
+    return log_config.sample_rate >= 1 or random.random() < log_config.sample_rate
+
+def log_content(kind: str, provider: str, model: str, content: str):
+    """Registra prompts/respuestas solo si LOG_PROMPT_CONTENT está activo, redactados."""
+    if not log_config.log_content:
+        return
+    logger.info(kind, extra={"fields": {"provider": provider, "model": model, "content": redact(content)}})
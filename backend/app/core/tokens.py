@@ -0,0 +1,34 @@
+import json
+import math
+from typing import Any, Dict, List
+
+# Heurística de ~4 caracteres por token (razonable para español/inglés y JSON)
+CHARS_PER_TOKEN = 4.0
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida de tokens de un texto, sin tokenizer."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """Tokens estimados de una lista de mensajes de chat."""
+    return sum(estimate_tokens(msg.get('content') or '') for msg in messages)
+
+def strip_descriptions(value: Any) -> Any:
+    """Copia de un schema sin los textos 'description' (solo guían al modelo)."""
+    if isinstance(value, dict):
+        return {
+            k: strip_descriptions(v)
+            for k, v in value.items()
+            if not (k == 'description' and isinstance(v, str))
+        }
+    if isinstance(value, list):
+        return [strip_descriptions(v) for v in value]
+    return value
+
+def dump_json(value: Any, compact: bool = False) -> str:
+    """Serializa JSON para incrustar en un prompt: indentado o minificado."""
+    if compact:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(value, indent=2, ensure_ascii=False)
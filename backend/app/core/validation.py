@@ -0,0 +1,85 @@
+import json
+import hashlib
+import threading
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from jsonschema import validators
+
+logger = logging.getLogger(__name__)
+
+class SchemaValidatorCache:
+    """
+    Validadores JSON Schema compilados una sola vez por schema.
+
+    La clave es un hash del contenido del schema, así que dos copias iguales
+    comparten validador y un schema editado genera uno nuevo. El metaschema
+    se verifica solo al compilar, no en cada respuesta.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._validators: Dict[str, Any] = {}
+        # id(schema) -> (schema, hash): evita re-serializar el mismo objeto
+        self._ids: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+
+    def schema_hash(self, schema: Dict[str, Any]) -> str:
+        """Hash estable del contenido de un schema."""
+        cached = self._ids.get(id(schema))
+        if cached is not None and cached[0] is schema:
+            return cached[1]
+        digest = hashlib.sha256(
+            json.dumps(schema, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        with self._lock:
+            if len(self._ids) >= self.max_entries * 4:
+                self._ids.clear()
+            self._ids[id(schema)] = (schema, digest)
+        return digest
+
+    def get_validator(self, schema: Dict[str, Any]):
+        """Devuelve un validador compilado para el schema."""
+        key = self.schema_hash(schema)
+        validator = self._validators.get(key)
+        if validator is not None:
+            return validator
+
+        cls = validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema)
+        with self._lock:
+            if len(self._validators) >= self.max_entries:
+                self._validators.pop(next(iter(self._validators)))
+            self._validators[key] = validator
+        return validator
+
+    def validate(self, instance: Any, schema: Dict[str, Any]) -> List[str]:
+        """Valida en una pasada y devuelve todos los errores (lista vacía si es válido)."""
+        return self.validate_detailed(instance, schema)[0]
+
+    def validate_detailed(
+        self,
+        instance: Any,
+        schema: Dict[str, Any],
+        limit: Optional[int] = None
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Como validate, pero además devuelve la ubicación de cada error como
+        "ruta (validador)". Las ubicaciones no incluyen valores del documento,
+        así que se pueden loguear sin exponer contenido.
+        """
+        validator = self.get_validator(schema)
+        errors, locations = [], []
+        for error in islice(validator.iter_errors(instance), limit):
+            location = '/'.join(str(p) for p in error.absolute_path)
+            errors.append(f"{location}: {error.message}" if location else error.message)
+            locations.append(f"/{location} ({error.validator})")
+        return errors, locations
+
+    def stats(self) -> Dict[str, Any]:
+        """Validadores compilados en memoria."""
+        return {"validators": len(self._validators), "max_entries": self.max_entries}
+
+schema_validators = SchemaValidatorCache()
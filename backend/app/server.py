@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import signal
+import logging
+from typing import Any, Dict
+
+import uvicorn
+
+from app.core.prompts import prompt_manager
+from app.core.telemetry import log_config
+from app.services.capacity import capacity_manager
+
+logger = logging.getLogger(__name__)
+
+class ProductionConfig:
+    """Configuración del modo producción (variables de entorno o argumentos)."""
+    def __init__(self):
+        self.host = os.getenv("HOST", "0.0.0.0")
+        self.port = int(os.getenv("PORT", "8000"))
+        self.workers = int(os.getenv("WEB_CONCURRENCY", "0")) or (os.cpu_count() or 1)
+        # Segundos para terminar las peticiones HTTP en curso tras SIGTERM
+        self.graceful_timeout = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+        # Segundos extra para las llamadas de IA que siguen en vuelo (ver AIService.drain)
+        self.drain_timeout = float(os.getenv("AI_DRAIN_TIMEOUT", "30"))
+        self.freeze_assets = os.getenv("PROMPTS_FROZEN", "1").lower() in ("1", "true", "yes")
+
+def preload() -> Dict[str, Any]:
+    """
+    Carga y compila todo lo que los workers comparten antes del fork:
+    archivos de prompts/, templates y validadores de schema.
+    """
+    started = time.perf_counter()
+    warmed = prompt_manager.warm()
+    return {"version": prompt_manager.registry.snapshot.version, **warmed, "seconds": round(time.perf_counter() - started, 3)}
+
+def run_production(app: Any, config: ProductionConfig):
+    """
+    Modo producción: un proceso maestro abre el socket, precarga los assets y
+    hace fork de N workers uvicorn sin estado compartido (salvo la cache SQLite
+    opcional). Los clientes de IA se crean en cada worker al primer uso.
+
+    SIGTERM/SIGINT en el maestro se reenvía a los workers, que dejan de aceptar
+    conexiones, terminan las peticiones en curso y drenan las llamadas de IA.
+    Un worker que muere inesperadamente se vuelve a lanzar.
+    """
+    logging.basicConfig(level=log_config.level, stream=sys.stdout)
+    if not hasattr(os, "fork"):
+        logger.warning("os.fork not available, running a single worker")
+        uvicorn.run(app, host=config.host, port=config.port, timeout_graceful_shutdown=config.graceful_timeout)
+        return
+
+    os.environ["WEB_CONCURRENCY"] = str(config.workers)
+    capacity_manager.set_workers(config.workers)
+    # Con frozen los workers no vigilan prompts/: se reinicia para cambiarlos
+    prompt_manager.registry.frozen = config.freeze_assets
+    logger.info(f"Preloaded assets: {preload()}")
+
+    uv_config = uvicorn.Config(
+        app,
+        host=config.host,
+        port=config.port,
+        timeout_graceful_shutdown=config.graceful_timeout,
+        log_config=None,
+        access_log=False,
+    )
+    uv_config.load()
+    sock = uv_config.bind_socket()
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                uvicorn.Server(uv_config).run(sockets=[sock])
+            except BaseException:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = slot
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info(f"Received signal {signum}, draining {len(children)} workers")
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(config.workers):
+        spawn(slot)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + config.graceful_timeout + config.drain_timeout + 5
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning("Workers did not exit in time, killing them")
+                for child in list(children):
+                    try:
+                        os.kill(child, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                deadline = float("inf")
+            time.sleep(0.1)
+            continue
+        slot = children.pop(pid, None)
+        if slot is None:
+            continue
+        if not stopping:
+            logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+            time.sleep(1)
+            spawn(slot)
+
+    sock.close()
+    logger.info("All workers stopped")
@@ -1,33 +1,198 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
+import httpx
 import os
 import json
-from typing import List, Dict, Optional
-from jsonschema import validate, ValidationError
+import time
+import asyncio
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+from app.core.validation import schema_validators
+from app.core.tokens import estimate_messages_tokens
+from app.core.telemetry import metrics, span, log_content
+from app.services.response_cache import response_cache
+from app.services.single_flight import single_flight
+from app.services.capacity import capacity_manager, ProviderOverloaded
+from app.services.router import provider_router, Route
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _env_float(name: str, default: float) -> float:
+    """Lee un float desde el entorno, usando el default si falta o es inválido."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Invalid value for {name}: {value!r}, using {default}")
+        return default
+
+
+class HTTPPoolConfig:
+    """Configuración del pool HTTP compartido por cada proveedor."""
+    def __init__(self):
+        self.timeout: float = _env_float("AI_HTTP_TIMEOUT", 120.0)
+        self.connect_timeout: float = _env_float("AI_HTTP_CONNECT_TIMEOUT", 10.0)
+        self.max_connections: int = int(_env_float("AI_HTTP_MAX_CONNECTIONS", 200))
+        self.max_keepalive: int = int(_env_float("AI_HTTP_MAX_KEEPALIVE", 50))
+        self.keepalive_expiry: float = _env_float("AI_HTTP_KEEPALIVE_EXPIRY", 30.0)
+        # Reintentos internos del SDK. En 0 cada 429/5xx llega al limitador
+        # adaptativo en vez de reintentarse a ciegas con el backoff del SDK.
+        self.max_retries: int = int(_env_float("AI_MAX_RETRIES", 0))
+
+    def build_client(self) -> httpx.AsyncClient:
+        """Crea un cliente HTTP asíncrono con conexiones reutilizables."""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+
+
 class AIService:
     def __init__(self):
         # Configurar OpenAI/DeepSeek (usan la misma API)
-        openai_key = os.getenv("OPENAI_API_KEY")
-        deepseek_key = os.getenv("DEEPSEEK_API_KEY")
+        self.openai_key = os.getenv("OPENAI_API_KEY")
+        self.deepseek_key = os.getenv("DEEPSEEK_API_KEY")
         
+        self.pool_config = HTTPPoolConfig()
         self.openai_client = None
         self.deepseek_client = None
+        # Los clientes se crean en el primer uso dentro de cada proceso: un pool
+        # HTTP creado antes del fork de los workers no debe compartirse.
+        self._client_pid: Optional[int] = None
+        # Llamadas a proveedores en curso, para el drenado al apagar
+        self.inflight = 0
         
-        if openai_key:
-            self.openai_client = OpenAI(api_key=openai_key)
+        if not self.openai_key and not self.deepseek_key:
+            logger.warning("No AI API keys found in environment")
+
+    def _ensure_clients(self):
+        """Crea los clientes de este proceso; descarta los heredados de otro."""
+        pid = os.getpid()
+        if self._client_pid != pid:
+            if self._client_pid is not None:
+                self.openai_client = None
+                self.deepseek_client = None
+            self._client_pid = pid
+
+        # Cada proveedor tiene su propio pool HTTP asíncrono, así las llamadas
+        # lentas no bloquean el event loop ni compiten por conexiones.
+        if self.openai_client is None and self.openai_key:
+            self.openai_client = AsyncOpenAI(
+                api_key=self.openai_key,
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                http_client=self.pool_config.build_client(),
+                max_retries=self.pool_config.max_retries
+            )
         
-        if deepseek_key:
+        if self.deepseek_client is None and self.deepseek_key:
             # DeepSeek usa la API de OpenAI pero con base_url diferente
-            self.deepseek_client = OpenAI(
-                api_key=deepseek_key,
-                base_url="https://api.deepseek.com"
+            self.deepseek_client = AsyncOpenAI(
+                api_key=self.deepseek_key,
+                base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                http_client=self.pool_config.build_client(),
+                max_retries=self.pool_config.max_retries
             )
+
+    async def drain(self, timeout: float = 30.0) -> int:
+        """Espera a que terminen las llamadas en curso; devuelve las que quedaron pendientes."""
+        deadline = time.monotonic() + timeout
+        while self.inflight > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.inflight:
+            logger.warning(f"Drain timed out with {self.inflight} AI calls in flight")
+        return self.inflight
+
+    async def aclose(self):
+        """Cierra los pools HTTP de todos los proveedores."""
+        for client in (self.openai_client, self.deepseek_client):
+            if client is not None:
+                await client.close()
+        self.openai_client = None
+        self.deepseek_client = None
+
+    def _get_client(self, provider: str) -> Tuple[Optional[AsyncOpenAI], Optional[str]]:
+        """Devuelve (cliente, error) para el proveedor indicado."""
+        self._ensure_clients()
+        if provider == "deepseek":
+            if not self.deepseek_client:
+                return None, "DeepSeek API key not configured"
+            return self.deepseek_client, None
+        elif provider == "openai":
+            if not self.openai_client:
+                return None, "OpenAI API key not configured"
+            return self.openai_client, None
+        return None, f"Unknown provider: {provider}"
+
+    def _build_params(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        force_json: bool,
+        expected_schema: Optional[Dict]
+    ) -> Dict[str, Any]:
+        """Arma los parámetros de la petición de chat."""
+        params = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0.7
+        }
         
-        if not self.openai_client and not self.deepseek_client:
-            logger.warning("No AI API keys found in environment")
+        # Si hay schema esperado, forzar JSON
+        if expected_schema or force_json:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    def validate_content(
+        self,
+        content: Optional[str],
+        expected_schema: Optional[Dict],
+        collect_all_errors: bool = True,
+        provider: str = "",
+        model: str = ""
+    ) -> Dict[str, Any]:
+        """Valida el contenido de una respuesta contra el schema, si existe."""
+        if not expected_schema or not content:
+            return {"content": content}
+
+        try:
+            response_json = json.loads(content)
+        except json.JSONDecodeError as e:
+            metrics.inc("vrm_validation_failures_total", kind="json")
+            logger.error(f"Response is not valid JSON: {e}")
+            return {
+                "content": content,
+                "validation_error": f"Invalid JSON: {str(e)}"
+            }
+
+        # Validador compilado y cacheado por hash del schema
+        with span("validation"):
+            errors, locations = schema_validators.validate_detailed(
+                response_json, expected_schema, None if collect_all_errors else 1
+            )
+
+        if errors:
+            metrics.inc("vrm_validation_failures_total", kind="schema")
+            # Los mensajes de jsonschema incluyen valores de la respuesta: solo
+            # se loguean con LOG_PROMPT_CONTENT, redactados
+            logger.error(f"Schema validation failed with {len(errors)} errors at {', '.join(locations[:10])}")
+            log_content("schema_errors", provider, model, "\n".join(errors))
+            return {
+                "content": content,
+                "validation_error": f"Schema validation failed: {errors[0]}",
+                "validation_errors": errors
+            }
+
+        logger.debug("Response validated successfully against schema")
+        return {
+            "content": content,
+            "validated": True
+        }
 
     async def get_chat_completion(
         self, 
@@ -35,7 +200,11 @@ class AIService:
         model: str = "deepseek-chat",
         force_json: bool = False,
         expected_schema: Optional[Dict] = None,
-        provider: str = "deepseek"
+        provider: str = "deepseek",
+        collect_all_errors: bool = True,
+        use_cache: bool = True,
+        routes: Optional[List[Route]] = None,
+        prompt_version: Optional[str] = None
     ) -> Dict[str, any]:
         """
         Envía una petición a un proveedor de IA con soporte para validación de schema.
@@ -46,86 +215,233 @@ class AIService:
             force_json: Si True, fuerza respuesta en formato JSON
             expected_schema: Schema JSON para validar la respuesta
             provider: Proveedor a usar (deepseek, openai)
+            collect_all_errors: Si True, reporta todos los errores de schema en 'validation_errors'
+            use_cache: Si True, reutiliza respuestas validadas idénticas (ver ResponseCache)
+            routes: Proveedores/modelos permitidos en orden de preferencia; si se
+                omite se usa provider/model con el secundario por defecto
+            prompt_version: Versión del snapshot de prompts, parte de la clave de cache
             
         Returns:
-            Dict con 'content' y opcionalmente 'validation_error'
+            Dict con 'content', 'provider', 'model', 'hedged', 'cache' (hit/miss/bypass)
+            y opcionalmente 'validation_error'
         """
+        routes = self._available_routes(routes or self.default_routes(provider, model))
+
+        async def call(route_provider: str, route_model: str) -> Dict[str, Any]:
+            return await self._complete(
+                messages, route_model, force_json, expected_schema, route_provider, collect_all_errors
+            )
+
+        if not use_cache:
+            result = await provider_router.complete(routes, call)
+            result["cache"] = "bypass"
+            return result
+
+        cache_key = response_cache.make_key(
+            messages, routes[0]["model"], routes[0]["provider"], force_json, expected_schema,
+            extra={"routes": routes, "prompt_version": prompt_version}
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            cached["cache"] = "hit"
+            return cached
+
+        async def complete_and_store() -> Dict[str, Any]:
+            result = await provider_router.complete(routes, call)
+            # Dentro de la llamada compartida: se guarda una vez aunque quien
+            # la inició se haya cancelado
+            await response_cache.set(cache_key, result)
+            return result
+
+        # Peticiones idénticas concurrentes comparten una sola llamada al proveedor
+        result = await single_flight.do(cache_key, complete_and_store)
+        result["cache"] = "miss"
+        return result
+
+    def default_routes(self, provider: str, model: str) -> List[Route]:
+        """Ruta pedida más el proveedor secundario configurado (AI_SECONDARY_ROUTE)."""
+        routes = [{"provider": provider, "model": model}]
+        secondary = os.getenv("AI_SECONDARY_ROUTE", "openai:gpt-4o-mini")
+        if secondary:
+            sec_provider, _, sec_model = secondary.partition(":")
+            if sec_provider != provider and sec_model:
+                routes.append({"provider": sec_provider, "model": sec_model})
+        return routes
+
+    def _available_routes(self, routes: List[Route]) -> List[Route]:
+        """Descarta rutas sin cliente configurado (si no queda ninguna, deja la primera)."""
+        available = [r for r in routes if self._get_client(r["provider"])[0] is not None]
+        return available or routes[:1]
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        force_json: bool,
+        expected_schema: Optional[Dict],
+        provider: str,
+        collect_all_errors: bool
+    ) -> Dict[str, Any]:
+        """Llamada real al proveedor, sin cache."""
         # Seleccionar cliente
-        if provider == "deepseek":
-            client = self.deepseek_client
-            if not client:
-                return {"content": None, "error": "DeepSeek API key not configured"}
-        elif provider == "openai":
-            client = self.openai_client
-            if not client:
-                return {"content": None, "error": "OpenAI API key not configured"}
-        else:
-            return {"content": None, "error": f"Unknown provider: {provider}"}
+        client, error = self._get_client(provider)
+        if error:
+            return {"content": None, "error": error}
         
+        # Admisión: cola acotada + rate limit por proveedor/modelo
+        capacity = capacity_manager.get(provider, model)
         try:
-            # Configurar parámetros
-            params = {
-                "model": model,
-                "messages": messages,
-                "temperature": 0.7
+            with span("queue_wait"):
+                await capacity.acquire(estimate_messages_tokens(messages))
+        except ProviderOverloaded as e:
+            metrics.inc("vrm_provider_errors_total", provider=provider, kind="rejected")
+            logger.warning(f"Request rejected for {provider}:{model}: {e}")
+            return {
+                "content": None,
+                "error": f"Proveedor saturado: {str(e)}",
+                "overloaded": True,
+                "retry_after": round(e.retry_after, 1)
             }
+
+        overloaded = False
+        retry_after = None
+        cancelled = False
+        self.inflight += 1
+        try:
+            # Configurar parámetros
+            params = self._build_params(messages, model, force_json, expected_schema)
             
-            # Si hay schema esperado, forzar JSON
-            if expected_schema or force_json:
-                params["response_format"] = {"type": "json_object"}
-            
-            # --- LOG PETICIÓN ---
-            print("\n" + "="*50)
-            print(f"🚀 ENVIANDO PETICIÓN A IA ({provider.upper()})")
-            print(f"Modelo: {model}")
-            for msg in messages:
-                print(msg.get('content', ''))
-            print("="*50 + "\n")
+            # Contenido solo con LOG_PROMPT_CONTENT activo (redactado)
+            log_content("ai_request", provider, model, "\n".join(msg.get('content', '') for msg in messages))
             
             # Llamar a la IA
-            response = client.chat.completions.create(**params)
+            with span("upstream"):
+                response = await client.chat.completions.create(**params)
             content = response.choices[0].message.content
+            usage = getattr(response, "usage", None)
             
-            # --- LOG RESPUESTA ---
-            print("\n" + "✨"*25)
-            print(f"📥 RESPUESTA RECIBIDA DE IA ({provider.upper()})")
-            print(content)
-            print("✨"*25 + "\n")
+            log_content("ai_response", provider, model, content or '')
             
             # Validar contra schema si existe
-            if expected_schema and content:
-                try:
-                    response_json = json.loads(content)
-                    validate(instance=response_json, schema=expected_schema)
-                    print("✅ VALIDACIÓN DE SCHEMA: EXITOSA")
-                    logger.info("Response validated successfully against schema")
-                    return {
-                        "content": content,
-                        "validated": True
-                    }
-                except json.JSONDecodeError as e:
-                    print(f"❌ ERROR: JSON INVÁLIDO -> {e}")
-                    logger.error(f"Response is not valid JSON: {e}")
-                    return {
-                        "content": content,
-                        "validation_error": f"Invalid JSON: {str(e)}"
-                    }
-                except ValidationError as e:
-                    print(f"❌ ERROR: FALLO DE SCHEMA -> {e.message}")
-                    logger.error(f"Schema validation failed: {e.message}")
-                    return {
-                        "content": content,
-                        "validation_error": f"Schema validation failed: {e.message}"
-                    }
-            
-            return {"content": content}
+            result = self.validate_content(content, expected_schema, collect_all_errors, provider, model)
+            if usage is not None:
+                result["usage"] = {
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens
+                }
+            return result
             
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
         except Exception as e:
-            print(f"🔥 ERROR GENERAL IA: {e}")
+            overloaded = self._is_overload_error(e)
+            metrics.inc("vrm_provider_errors_total", provider=provider, kind="overload" if overloaded else "error")
             logger.error(f"Error calling {provider}: {e}")
-            return {
+            result = {
+                "content": None,
+                "error": f"Error en la comunicación con IA: {str(e)}"
+            }
+            if overloaded:
+                retry_after = self._retry_after(e)
+                result.update(overloaded=True, retry_after=round(retry_after or 1.0, 1))
+            return result
+        finally:
+            self.inflight -= 1
+            await capacity.release(overloaded, retry_after, neutral=cancelled)
+
+    async def stream_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "deepseek-chat",
+        force_json: bool = False,
+        expected_schema: Optional[Dict] = None,
+        provider: str = "deepseek",
+        collect_all_errors: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Igual que get_chat_completion pero reenvía los tokens a medida que llegan.
+
+        Emite eventos {"type": "token", "content": ...} y termina con un único
+        {"type": "result", ...} que contiene el mismo dict que get_chat_completion.
+        """
+        client, error = self._get_client(provider)
+        if error:
+            yield {"type": "result", "content": None, "error": error}
+            return
+
+        capacity = capacity_manager.get(provider, model)
+        try:
+            await capacity.acquire(estimate_messages_tokens(messages))
+        except ProviderOverloaded as e:
+            yield {
+                "type": "result",
                 "content": None,
+                "error": f"Proveedor saturado: {str(e)}",
+                "overloaded": True,
+                "retry_after": round(e.retry_after, 1)
+            }
+            return
+
+        parts: List[str] = []
+        overloaded = False
+        retry_after = None
+        cancelled = False
+        self.inflight += 1
+        try:
+            params = self._build_params(messages, model, force_json, expected_schema)
+            params["stream"] = True
+            stream = await client.chat.completions.create(**params)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield {"type": "token", "content": delta}
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            overloaded = self._is_overload_error(e)
+            if overloaded:
+                retry_after = self._retry_after(e)
+            metrics.inc("vrm_provider_errors_total", provider=provider, kind="overload" if overloaded else "error")
+            logger.error(f"Error streaming from {provider}: {e}")
+            result = {
+                "type": "result",
+                "content": ''.join(parts) or None,
                 "error": f"Error en la comunicación con IA: {str(e)}"
             }
+            if overloaded:
+                result.update(overloaded=True, retry_after=round(retry_after or 1.0, 1))
+            yield result
+            return
+        finally:
+            self.inflight -= 1
+            await capacity.release(overloaded, retry_after, neutral=cancelled)
+
+        result = self.validate_content(''.join(parts), expected_schema, collect_all_errors, provider, model)
+        yield {"type": "result", **result}
+
+    def _is_overload_error(self, error: Exception) -> bool:
+        """True si el error indica falta de capacidad del proveedor (429/5xx)."""
+        status = getattr(error, "status_code", None)
+        return isinstance(error, RateLimitError) or (status is not None and status >= 500)
+
+    def _retry_after(self, error: Exception) -> Optional[float]:
+        """Segundos indicados por el proveedor en Retry-After / retry-after-ms, si vinieron."""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000.0
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return None
 
 ai_service = AIService()
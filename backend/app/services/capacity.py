@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS: Dict[str, Any] = {
+    "rpm": 0,                   # peticiones por minuto (0 = sin límite)
+    "tpm": 0,                   # tokens estimados por minuto (0 = sin límite)
+    "initial_concurrency": 32,
+    "min_concurrency": 2,
+    "max_concurrency": 128,
+    "max_queue": 256,           # peticiones esperando admisión
+    "queue_timeout": 30.0,      # segundos máximos de espera en la cola
+}
+
+class ProviderOverloaded(Exception):
+    """El proveedor no tiene capacidad para admitir la petición a tiempo."""
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Token bucket con recarga continua; una tasa de 0 significa sin límite."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` tokens disponibles."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+class AdaptiveLimiter:
+    """
+    Límite de concurrencia AIMD con cola de admisión acotada.
+
+    Crece de forma aditiva con cada éxito y se reduce a la mitad ante un
+    429/5xx. Si la cola está llena o la espera supera el deadline, falla
+    de inmediato con ProviderOverloaded.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, max_queue: int):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.inflight = 0
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+
+    def _has_slot(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    async def acquire(self, timeout: float):
+        if self._has_slot() and not self.waiting:
+            self.inflight += 1
+            return
+        if self.waiting >= self.max_queue:
+            raise ProviderOverloaded("Admission queue full", retry_after=timeout)
+
+        self.waiting += 1
+        try:
+            async with self._cond:
+                await asyncio.wait_for(self._cond.wait_for(self._has_slot), timeout)
+                self.inflight += 1
+        except asyncio.TimeoutError:
+            raise ProviderOverloaded("Timed out waiting for provider capacity", retry_after=timeout)
+        finally:
+            self.waiting -= 1
+
+    async def release(self):
+        self.inflight -= 1
+        async with self._cond:
+            self._cond.notify()
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+        logger.warning(f"Provider overloaded, concurrency limit reduced to {int(self.limit)}")
+
+class ProviderCapacity:
+    """Rate limit (rpm/tpm) + concurrencia adaptativa para un proveedor/modelo."""
+
+    def __init__(self, limits: Dict[str, Any]):
+        self.limits = limits
+        self.requests = TokenBucket(limits["rpm"])
+        self.tokens = TokenBucket(limits["tpm"])
+        self.limiter = AdaptiveLimiter(
+            limits["initial_concurrency"],
+            limits["min_concurrency"],
+            limits["max_concurrency"],
+            limits["max_queue"],
+        )
+        self.rejected = 0
+        # Pausa pedida por el proveedor (Retry-After de un 429)
+        self.cooldown_until = 0.0
+
+    async def acquire(self, estimated_tokens: int):
+        """Espera turno en la cola y en los buckets, dentro de queue_timeout."""
+        deadline = time.monotonic() + self.limits["queue_timeout"]
+        try:
+            await self.limiter.acquire(self.limits["queue_timeout"])
+        except ProviderOverloaded:
+            self.rejected += 1
+            raise
+
+        try:
+            while True:
+                wait = max(
+                    self.cooldown_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens)
+                )
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(estimated_tokens)
+                    return
+                if time.monotonic() + wait > deadline:
+                    raise ProviderOverloaded("Rate limit budget exhausted", retry_after=wait)
+                await asyncio.sleep(wait)
+        except ProviderOverloaded:
+            self.rejected += 1
+            await self.limiter.release()
+            raise
+        except BaseException:
+            await self.limiter.release()
+            raise
+
+    async def release(self, overloaded: bool = False, retry_after: Optional[float] = None, neutral: bool = False):
+        """
+        Libera el slot y ajusta el límite según el resultado. Con neutral=True
+        (llamada cancelada, p. ej. el duplicado perdedor de un hedge) no se ajusta.
+        """
+        if overloaded:
+            self.limiter.on_overload()
+            if retry_after:
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+        elif not neutral:
+            self.limiter.on_success()
+        await self.limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": int(self.limiter.limit),
+            "inflight": self.limiter.inflight,
+            "queued": self.limiter.waiting,
+            "rejected": self.rejected,
+        }
+
+class CapacityManager:
+    """
+    Capacidad por proveedor y modelo, configurable con AI_CAPACITY (JSON).
+
+    Las claves pueden ser "proveedor" o "proveedor:modelo"; la más específica
+    gana. Ejemplo: {"deepseek": {"rpm": 600, "tpm": 1000000}}.
+
+    Los límites rpm/tpm son de la cuenta del proveedor: con varios workers
+    cada proceso se queda con su parte (ver set_workers).
+    """
+
+    def __init__(self, config: Optional[Dict[str, Dict[str, Any]]] = None, workers: int = 1):
+        self.config = config or {}
+        self.workers = max(1, workers)
+        self._providers: Dict[Tuple[str, str], ProviderCapacity] = {}
+
+    def set_workers(self, workers: int):
+        """Reparte rpm/tpm entre `workers` procesos (aplica a capacidades nuevas)."""
+        self.workers = max(1, workers)
+        self._providers.clear()
+
+    def _limits_for(self, provider: str, model: str) -> Dict[str, Any]:
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(self.config.get(provider, {}))
+        limits.update(self.config.get(f"{provider}:{model}", {}))
+        for key in ("rpm", "tpm"):
+            limits[key] = limits[key] / self.workers
+        return limits
+
+    def get(self, provider: str, model: str) -> ProviderCapacity:
+        key = (provider, model)
+        capacity = self._providers.get(key)
+        if capacity is None:
+            capacity = ProviderCapacity(self._limits_for(provider, model))
+            self._providers[key] = capacity
+        return capacity
+
+    def stats(self) -> Dict[str, Any]:
+        return {f"{p}:{m}": c.stats() for (p, m), c in self._providers.items()}
+
+def _load_config() -> Dict[str, Dict[str, Any]]:
+    raw = os.getenv("AI_CAPACITY")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid AI_CAPACITY config: {e}")
+        return {}
+
+capacity_manager = CapacityManager(_load_config(), int(os.getenv("WEB_CONCURRENCY", "1")))
@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TERMINAL_STATUSES = ("done", "failed")
+# Campos de control que no cambian el resultado y no forman parte de la clave de idempotencia
+CONTROL_FIELDS = ("priority", "user_id")
+
+Runner = Callable[[str, str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+class JobStore:
+    """
+    Jobs persistidos en SQLite (WAL), compartidos por todos los workers.
+
+    Un job activo (queued/running/done) es único por clave de idempotencia,
+    así que reenviar el mismo payload devuelve el job existente. Los jobs
+    terminados se borran pasado el tiempo de retención.
+
+    Un job tomado tiene un lease (token + vencimiento) que el worker renueva
+    mientras lo procesa; si el worker muere, el lease vence y el job vuelve a
+    la cola. Solo el dueño del lease puede terminarlo o reencolarlo.
+
+    La base se crea en el primer uso, no al importar el módulo.
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 86400, lease_seconds: float = 30):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init()
+                    self._initialized = True
+        return self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._open() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, idem_key TEXT NOT NULL, user_id TEXT NOT NULL, "
+                "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, "
+                "category TEXT NOT NULL, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, available_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, lease_token TEXT, lease_until REAL)"
+            )
+            # Un solo job vivo por clave: los fallidos permiten volver a encolar
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_idem ON jobs (idem_key) "
+                "WHERE status IN ('queued', 'running', 'done')"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)")
+
+    @staticmethod
+    def idempotency_key(category: str, name: str, identity: Optional[str], payload: Dict[str, Any]) -> str:
+        """
+        Clave de idempotencia: tarea, payload e identidad explícita del cliente.
+        Nunca la IP: un reintento desde otra red debe volver al mismo job.
+        """
+        material = {
+            "category": category,
+            "name": name,
+            "user": identity,
+            "payload": {k: v for k, v in payload.items() if k not in CONTROL_FIELDS},
+        }
+        return hashlib.sha256(
+            json.dumps(material, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+
+    def submit(
+        self,
+        category: str,
+        name: str,
+        user_id: str,
+        priority: int,
+        payload: Dict[str, Any],
+        identity: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Encola un job o devuelve el existente con el mismo payload (attached=True).
+        `user_id` solo se usa para el reparto justo; `identity` (si el cliente la
+        envía) es la que separa jobs idénticos de usuarios distintos.
+        """
+        idem_key = self.idempotency_key(category, name, identity, payload)
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, idem_key, user_id, priority, status, category, name, "
+                "payload, created_at, available_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, idem_key, user_id, priority, category, name,
+                 json.dumps(payload, ensure_ascii=False), now, now)
+            ).rowcount
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE idem_key = ? AND status IN ('queued', 'running', 'done')",
+                (idem_key,)
+            ).fetchone()
+        job = self._to_dict(row)
+        job["attached"] = not inserted
+        return job
+
+    def claim(self, max_per_user: int) -> Optional[Dict[str, Any]]:
+        """
+        Toma el siguiente job de forma atómica: mayor prioridad primero y, dentro
+        de la misma prioridad, round-robin entre usuarios (cuenta sus jobs en
+        curso más su posición en la cola), con un máximo en curso por usuario.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, "
+                "lease_token = ?, lease_until = ? "
+                "WHERE id = ("
+                "  SELECT q.id FROM ("
+                "    SELECT id, user_id, priority, created_at, "
+                "      ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY priority DESC, created_at) AS user_rank "
+                "    FROM jobs WHERE status = 'queued' AND available_at <= ?"
+                "  ) q LEFT JOIN ("
+                "    SELECT user_id, COUNT(*) AS running FROM jobs WHERE status = 'running' GROUP BY user_id"
+                "  ) r ON r.user_id = q.user_id "
+                "  WHERE COALESCE(r.running, 0) < ? "
+                "  ORDER BY q.priority DESC, COALESCE(r.running, 0) + q.user_rank, q.created_at LIMIT 1"
+                ") AND status = 'queued' RETURNING *",
+                (now, uuid.uuid4().hex, now + self.lease_seconds, now, max_per_user)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def renew(self, job_id: str, token: str) -> bool:
+        """Extiende el lease; False si el job ya no es de este worker."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_token = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, token)
+            ).rowcount > 0
+
+    def finish(self, job_id: str, token: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        status = "failed" if error else "done"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                "lease_token = NULL, lease_until = NULL "
+                "WHERE id = ? AND lease_token = ? AND status = 'running'",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id, token)
+            )
+
+    def retry_later(self, job_id: str, token: str, delay: float):
+        """Devuelve el job a la cola para reintentarlo tras `delay` segundos."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, started_at = NULL, "
+                "lease_token = NULL, lease_until = NULL "
+                "WHERE id = ? AND lease_token = ? AND status = 'running'",
+                (time.time() + delay, job_id, token)
+            )
+
+    def requeue_expired(self, max_attempts: int) -> int:
+        """
+        Reencola los jobs 'running' cuyo lease venció (el worker murió o se colgó).
+        Los que ya agotaron sus intentos se marcan como fallidos.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Job abandonado: se agotaron los intentos', "
+                "finished_at = ?, lease_token = NULL, lease_until = NULL "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, max_attempts)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, lease_token = NULL, lease_until = NULL "
+                "WHERE status = 'running' AND lease_until < ?",
+                (now,)
+            ).rowcount
+        return failed + requeued
+
+    def purge(self) -> int:
+        """Borra jobs terminados más viejos que la retención."""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.retention_seconds,)
+            ).rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "category": row["category"],
+            "name": row["name"],
+            "priority": row["priority"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if row["status"] == "done" and row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"]:
+            job["error"] = row["error"]
+        job["_payload"] = row["payload"]
+        job["_user_id"] = row["user_id"]
+        job["_lease"] = row["lease_token"]
+        return job
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job sin los campos internos (payload y usuario)."""
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+class JobQueue:
+    """
+    Pool de workers asíncronos que procesa los jobs de /prompt en segundo plano.
+
+    Cada proceso corre JOBS_WORKERS workers sobre el mismo JobStore; los jobs
+    se toman con un UPDATE atómico, así varios procesos pueden compartir la
+    cola. Un 503 del proveedor no falla el job: vuelve a la cola con el
+    retry_after indicado, hasta JOBS_MAX_ATTEMPTS intentos. Los leases
+    vencidos (de cualquier proceso) se revisan periódicamente.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 4,
+        max_per_user: int = 2,
+        max_attempts: int = 5,
+        poll_interval: float = 0.5
+    ):
+        self.store = store
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.runner: Optional[Runner] = None
+        self.running = 0
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # job_id -> evento de fin, para long-poll en este proceso
+        self._done_events: Dict[str, asyncio.Event] = {}
+        self._last_purge = 0.0
+        self._last_requeue = 0.0
+
+    async def submit(
+        self,
+        category: str,
+        name: str,
+        user_id: str,
+        priority: int,
+        payload: Dict[str, Any],
+        identity: Optional[str] = None
+    ) -> Dict[str, Any]:
+        job = await asyncio.to_thread(self.store.submit, category, name, user_id, priority, payload, identity)
+        if not job["attached"] and self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id: str, timeout: float, last_status: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Long-poll: devuelve el job cuando termina, cuando su estado deja de ser
+        `last_status` (si se indica) o al vencer el timeout.
+        Los jobs de otros procesos se detectan consultando el store cada poll_interval.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            changed = last_status is not None and job is not None and job["status"] != last_status
+            if job is None or job["status"] in TERMINAL_STATUSES or changed or remaining <= 0:
+                self._done_events.pop(job_id, None)
+                return job
+            event = self._done_events.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.runner is None or self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.get_running_loop().create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 30.0):
+        """Deja de tomar jobs y espera a que terminen los que están en curso."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        deadline = time.monotonic() + timeout
+        while self.running > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                await self._housekeeping()
+                job = await asyncio.to_thread(self.store.claim, self.max_per_user)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {index} failed to claim: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Un job ya tomado se termina aunque el worker se esté cancelando
+            await asyncio.shield(self._run(job))
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id, token = job["job_id"], job["_lease"]
+        self.running += 1
+        # queued -> running: despierta a los que esperan un cambio de estado
+        self._notify(job_id)
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job_id, token))
+        try:
+            try:
+                result = await self.runner(job["category"], job["name"], json.loads(job["_payload"]))
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                result = {"error": str(e)}
+            finally:
+                heartbeat.cancel()
+
+            if result.get("overloaded") and job["attempts"] < self.max_attempts:
+                await asyncio.to_thread(self.store.retry_later, job_id, token, float(result.get("retry_after", 1.0)))
+                return
+            # Los errores (prompt inválido, proveedor caído, respuesta que no
+            # cumple el schema) marcan el job como fallido, así reenviar el mismo
+            # payload lo vuelve a intentar. Igual que la cache de respuestas, un
+            # resultado inválido nunca se guarda como "done".
+            ai_response = result.get("ai_response") or {}
+            error = result.get("error") or ai_response.get("error") or ai_response.get("validation_error")
+            if error:
+                await asyncio.to_thread(self.store.finish, job_id, token, None, error)
+            else:
+                await asyncio.to_thread(self.store.finish, job_id, token, result)
+            self._notify(job_id)
+        finally:
+            self.running -= 1
+
+    async def _heartbeat(self, job_id: str, token: str):
+        """Renueva el lease mientras el job está en curso."""
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            try:
+                if not await asyncio.to_thread(self.store.renew, job_id, token):
+                    logger.warning(f"Lost lease on job {job_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Failed to renew lease on job {job_id}: {e}")
+
+    def _notify(self, job_id: str):
+        event = self._done_events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _housekeeping(self):
+        """Reencola leases vencidos y borra jobs viejos, cada uno a su intervalo."""
+        now = time.monotonic()
+        if now - self._last_requeue >= self.store.lease_seconds / 2:
+            self._last_requeue = now
+            requeued = await asyncio.to_thread(self.store.requeue_expired, self.max_attempts)
+            if requeued:
+                logger.warning(f"Recovered {requeued} jobs with expired leases")
+        if now - self._last_purge >= 60:
+            self._last_purge = now
+            purged = await asyncio.to_thread(self.store.purge)
+            if purged:
+                logger.info(f"Purged {purged} expired jobs")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "jobs": self.store.counts(),
+        }
+
+job_queue = JobQueue(
+    JobStore(
+        os.getenv("JOBS_SQLITE") or os.path.join(BACKEND_DIR, "var", "jobs.sqlite3"),
+        retention_seconds=float(os.getenv("JOBS_RETENTION_SECONDS", "86400")),
+        lease_seconds=float(os.getenv("JOBS_LEASE_SECONDS", "30"))
+    ),
+    workers=int(os.getenv("JOBS_WORKERS", "4")),
+    max_per_user=int(os.getenv("JOBS_MAX_PER_USER", "2")),
+    max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "5")),
+    poll_interval=float(os.getenv("JOBS_POLL_INTERVAL", "0.5"))
+)
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from app.core.validation import schema_validators
+from app.core.telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Cache de respuestas de IA direccionada por contenido.
+
+    La clave es un hash de los mensajes finales más los parámetros del modelo,
+    así que dos peticiones con el mismo prompt resuelto comparten respuesta.
+    Tiene un nivel en memoria (LRU con TTL) y un nivel opcional en SQLite
+    que comparten todos los workers de uvicorn. Solo se guardan respuestas
+    que pasaron la validación de schema.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 86400,
+        max_entries: int = 1024,
+        sqlite_path: Optional[str] = None,
+        sqlite_max_entries: int = 10000
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.sqlite_path = sqlite_path
+        self.sqlite_max_entries = sqlite_max_entries
+        self.hits = 0
+        self.misses = 0
+        # key -> (expires_at, result)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if sqlite_path:
+            self._init_sqlite()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.sqlite_path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_sqlite(self):
+        directory = os.path.dirname(self.sqlite_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at)")
+
+    def make_key(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        provider: str,
+        force_json: bool,
+        expected_schema: Optional[Dict],
+        extra: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Hash de los mensajes finales y los parámetros que afectan la respuesta."""
+        material = {
+            "messages": messages,
+            "model": model,
+            "provider": provider,
+            "force_json": force_json,
+            "schema": schema_validators.schema_hash(expected_schema) if expected_schema else None,
+            "extra": extra or {},
+        }
+        return hashlib.sha256(
+            json.dumps(material, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Busca una respuesta en memoria y, si no está, en SQLite."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    metrics.inc("vrm_response_cache_total", result="hit", tier="memory")
+                    return dict(entry[1])
+                del self._memory[key]
+
+        if self.sqlite_path:
+            result = await asyncio.to_thread(self._sqlite_get, key, now)
+            if result is not None:
+                self._remember(key, result, now + self.ttl_seconds)
+                self.hits += 1
+                metrics.inc("vrm_response_cache_total", result="hit", tier="sqlite")
+                return dict(result)
+
+        self.misses += 1
+        metrics.inc("vrm_response_cache_total", result="miss", tier="all")
+        return None
+
+    async def set(self, key: str, result: Dict[str, Any]):
+        """Guarda una respuesta, solo si fue validada contra su schema."""
+        if not result.get("validated"):
+            return
+        value = {k: v for k, v in result.items() if k != "cache"}
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self.sqlite_path:
+            await asyncio.to_thread(self._sqlite_set, key, value, expires_at)
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _sqlite_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {e}")
+            return None
+
+    def _sqlite_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.sqlite_max_entries,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de uso de la cache."""
+        return {
+            "memory_entries": len(self._memory),
+            "sqlite": bool(self.sqlite_path),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+response_cache = ResponseCache(
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+    sqlite_path=os.getenv("RESPONSE_CACHE_SQLITE") or None,
+    sqlite_max_entries=int(os.getenv("RESPONSE_CACHE_SQLITE_MAX_ENTRIES", "10000"))
+)
@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+Route = Dict[str, str]  # {"provider": "...", "model": "..."}
+
+class ProviderStats:
+    """Latencias y errores recientes de un proveedor/modelo (ventana deslizante)."""
+
+    def __init__(self, window: int = 100):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+    def record(self, latency: float, ok: bool):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < 5:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self.outcomes),
+            "error_rate": round(self.error_rate, 3),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+def is_acceptable(result: Dict[str, Any]) -> bool:
+    """Una respuesta sirve si no hubo error ni fallo de validación de schema."""
+    return not result.get("error") and not result.get("validation_error")
+
+class ProviderRouter:
+    """
+    Enrutamiento entre proveedores con requests "hedged".
+
+    Envía al proveedor primario y, si tarda más que su percentil de latencia
+    configurado (o falla), lanza un duplicado al secundario. Gana la primera
+    respuesta que pase la validación; la otra se cancela. Los proveedores con
+    alta tasa de error se mueven al final de la lista.
+    """
+
+    def __init__(
+        self,
+        hedge_percentile: float = 95.0,
+        default_hedge_delay: float = 20.0,
+        min_hedge_delay: float = 1.0,
+        unhealthy_error_rate: float = 0.5
+    ):
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.hedges = 0
+        self._stats: Dict[Tuple[str, str], ProviderStats] = {}
+
+    def stats_for(self, route: Route) -> ProviderStats:
+        key = (route["provider"], route["model"])
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProviderStats()
+        return stats
+
+    def order(self, routes: List[Route]) -> List[Route]:
+        """Ordena las rutas dejando primero las sanas, respetando el orden declarado."""
+        healthy = [r for r in routes if self.stats_for(r).error_rate < self.unhealthy_error_rate]
+        unhealthy = [r for r in routes if r not in healthy]
+        return healthy + unhealthy
+
+    def hedge_delay(self, route: Route) -> float:
+        observed = self.stats_for(route).percentile(self.hedge_percentile)
+        if observed is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, observed)
+
+    async def _timed(self, route: Route, call: Callable[[str, str], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        start = time.monotonic()
+        result = await call(route["provider"], route["model"])
+        self.stats_for(route).record(time.monotonic() - start, not result.get("error"))
+        return {**result, "provider": route["provider"], "model": route["model"]}
+
+    async def complete(
+        self,
+        routes: List[Route],
+        call: Callable[[str, str], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Ejecuta `call(provider, model)` con hedging entre las rutas disponibles."""
+        ordered = self.order(routes)
+        if len(ordered) == 1:
+            return await self._timed(ordered[0], call)
+
+        primary, secondary = ordered[0], ordered[1]
+        pending = {asyncio.create_task(self._timed(primary, call))}
+        hedge_task: Optional[asyncio.Task] = None
+        fallback: Optional[Dict[str, Any]] = None
+        try:
+            timeout: Optional[float] = self.hedge_delay(primary)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if is_acceptable(result):
+                        return {**result, "hedged": hedge_task is not None}
+                    fallback = fallback or result
+
+                if hedge_task is None:
+                    # El primario tardó demasiado o falló: duplicar en el secundario
+                    self.hedges += 1
+                    logger.info(f"Hedging {primary['provider']}:{primary['model']} -> "
+                                f"{secondary['provider']}:{secondary['model']}")
+                    hedge_task = asyncio.create_task(self._timed(secondary, call))
+                    pending.add(hedge_task)
+                    timeout = None
+            return {**fallback, "hedged": hedge_task is not None}
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedges": self.hedges,
+            "providers": {f"{p}:{m}": s.snapshot() for (p, m), s in self._stats.items()},
+        }
+
+provider_router = ProviderRouter(
+    hedge_percentile=float(os.getenv("AI_HEDGE_PERCENTILE", "95")),
+    default_hedge_delay=float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "20"))
+)
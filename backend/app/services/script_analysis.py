@@ -0,0 +1,235 @@
+import os
+import json
+import asyncio
+import hashlib
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+import logging
+
+from app.core.prompts import prompt_manager, build_messages
+from app.core.segmentation import word_limits, count_words, split_units, pack_units, plan_incremental, build_analysis
+from app.core.validation import schema_validators
+from app.services.ai_service import ai_service
+from app.core.telemetry import log_content
+
+logger = logging.getLogger(__name__)
+
+class SegmentStateStore:
+    """
+    Último análisis por proyecto y por hash de contenido, para re-análisis incremental.
+
+    Guarda los fragmentos (como unidades) y la dirección generada para cada uno.
+    Acotado con LRU en memoria.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def script_hash(self, script: str, limits: List[float]) -> str:
+        material = json.dumps({"script": script, "limits": limits}, ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, project_id: Optional[str], previous_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+        for key in (f"project:{project_id}" if project_id else None, f"hash:{previous_hash}" if previous_hash else None):
+            if key and key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def put(
+        self,
+        project_id: Optional[str],
+        script: str,
+        limits: List[float],
+        chunks: List[List[str]],
+        directions: List[Optional[Dict[str, Any]]]
+    ) -> str:
+        """Guarda el análisis y devuelve el hash del guion (para usar como previous_hash)."""
+        digest = self.script_hash(script, limits)
+        state = {"limits": limits, "chunks": chunks, "directions": directions}
+        keys = [f"hash:{digest}"] + ([f"project:{project_id}"] if project_id else [])
+        for key in keys:
+            self._entries[key] = state
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return digest
+
+class ScriptAnalyzer:
+    """
+    Análisis de guiones con pre-segmentación local.
+
+    En lugar de pedirle al modelo que divida el guion completo y calcule los
+    tiempos, el guion se divide localmente respetando segment_minTime/maxTime
+    con la fórmula de WPM, y cada fragmento se envía en paralelo para obtener
+    solo tipo, dirección y subtítulos. El resultado final cumple SCRIPT_ANALYSIS.
+
+    Un guion no puede generar más de SCRIPT_MAX_SEGMENTS fragmentos, y a lo
+    sumo SCRIPT_MAX_CONCURRENCY se envían al modelo a la vez.
+    """
+
+    def __init__(
+        self,
+        direction_task: str = "SEGMENT_DIRECTION",
+        analysis_schema: str = "SCRIPT_ANALYSIS"
+    ):
+        self.direction_task = direction_task
+        self.analysis_schema = analysis_schema
+        self.states = SegmentStateStore(int(os.getenv("SEGMENT_STATE_MAX_ENTRIES", "512")))
+        self.max_segments = int(os.getenv("SCRIPT_MAX_SEGMENTS", "200"))
+        self.max_concurrency = max(1, int(os.getenv("SCRIPT_MAX_CONCURRENCY", "8")))
+
+    def _chunk_payloads(self, chunks: List[str], indices: List[int], payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        total = len(chunks)
+        return [
+            {
+                "SEGMENT": chunks[i],
+                "SEGMENT_POSITION": i + 1,
+                "TOTAL_SEGMENTS": total,
+                "PREVIOUS_SEGMENT": chunks[i - 1] if i > 0 else "(ninguno)",
+                "NEXT_SEGMENT": chunks[i + 1] if i < total - 1 else "(ninguno)",
+                "segment_RateWpm": payload.get("segment_RateWpm", 130.0),
+            }
+            for i in indices
+        ]
+
+    async def direct_chunks(self, chunks: List[str], indices: List[int], payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Pide al modelo la dirección de los fragmentos indicados, en paralelo (acotado)."""
+        resolved = prompt_manager.resolve_many("tasks", self.direction_task, self._chunk_payloads(chunks, indices, payload))
+        use_cache = not payload.get("bypass_cache", False)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def direct(formatted_prompt: str, context) -> Dict[str, Any]:
+            if formatted_prompt.startswith("Error:"):
+                return {"content": None, "error": formatted_prompt}
+            async with semaphore:
+                return await ai_service.get_chat_completion(
+                    messages=build_messages(formatted_prompt, context),
+                    force_json=True,
+                    expected_schema=context.expected_schema,
+                    use_cache=use_cache,
+                    routes=context.routes,
+                    prompt_version=context.prompt_version
+                )
+
+        return await asyncio.gather(*(direct(p, c) for p, c in resolved))
+
+    def _too_many_segments(self) -> str:
+        return (f"El guion genera más de {self.max_segments} segmentos: "
+                "acortalo o aumentá segment_maxTime")
+
+    def merge(self, chunks: List[str], directions: List[Optional[Dict[str, Any]]], wpm: float) -> Dict[str, Any]:
+        """
+        Une los fragmentos y su dirección en un resultado SCRIPT_ANALYSIS.
+
+        Solo queda "validated" si cumple el schema y todos los fragmentos tienen
+        dirección del modelo; los que fallaron llevan valores por defecto y se
+        listan en failed_segments.
+        """
+        languages = Counter(d["language"] for d in directions if d and d.get("language"))
+        language = languages.most_common(1)[0][0] if languages else "und"
+        analysis = build_analysis(chunks, directions, wpm, language)
+
+        schema = prompt_manager.get_schema(self.analysis_schema)
+        errors = schema_validators.validate(analysis, schema) if schema else []
+        response: Dict[str, Any] = {"content": json.dumps(analysis, ensure_ascii=False)}
+        failed = [i + 1 for i, d in enumerate(directions) if d is None]
+        if errors:
+            response["validation_error"] = f"Schema validation failed: {errors[0]}"
+            response["validation_errors"] = errors
+        elif failed:
+            response["validation_error"] = f"Sin dirección del modelo para los segmentos {failed}"
+        else:
+            response["validated"] = True
+        if failed:
+            response["failed_segments"] = failed
+        return response
+
+    async def analyze(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Segmenta localmente, dirige los fragmentos en paralelo y une el resultado.
+
+        Si el payload trae project_id o previous_hash y existe un análisis previo
+        con los mismos límites, solo se envían al modelo los fragmentos que
+        cambiaron; el resto reutiliza la dirección ya generada.
+        """
+        script = str(payload.get("SCRIPT", ""))
+        try:
+            min_time = float(payload.get("segment_minTime", 3.0))
+            max_time = float(payload.get("segment_maxTime", 10.0))
+            wpm = float(payload.get("segment_RateWpm", 130.0))
+        except (TypeError, ValueError):
+            return {"content": None, "error": "segment_minTime, segment_maxTime y segment_RateWpm deben ser números"}
+        if not (wpm > 0 and max_time > 0 and 0 <= min_time <= max_time):
+            return {
+                "content": None,
+                "error": "Límites inválidos: se requiere segment_RateWpm > 0 y 0 <= segment_minTime <= segment_maxTime, con segment_maxTime > 0"
+            }
+        min_words, max_words = word_limits(min_time, max_time, wpm)
+
+        # Cota rápida antes de segmentar: cada fragmento tiene a lo sumo max_words
+        if count_words(script) > self.max_segments * max_words:
+            return {"content": None, "error": self._too_many_segments()}
+
+        units = split_units(script, max_words)
+        if not units:
+            return {"content": None, "error": "El guion está vacío"}
+
+        limits = [min_words, max_words, wpm]
+        previous = None
+        if payload.get("incremental", True):
+            previous = self.states.get(payload.get("project_id"), payload.get("previous_hash"))
+            if previous and previous["limits"] != limits:
+                previous = None
+
+        if previous:
+            plan = [
+                (chunk_units, ci if ci is not None and previous["directions"][ci] else None)
+                for chunk_units, ci in plan_incremental(previous["chunks"], units, min_words, max_words)
+            ]
+        else:
+            plan = [(chunk_units, None) for chunk_units in pack_units(units, min_words, max_words)]
+
+        if len(plan) > self.max_segments:
+            return {"content": None, "error": self._too_many_segments()}
+
+        chunks = [' '.join(chunk_units) for chunk_units, _ in plan]
+        directions: List[Optional[Dict[str, Any]]] = [
+            previous["directions"][ci] if ci is not None else None for _, ci in plan
+        ]
+        dirty = [i for i, (_, ci) in enumerate(plan) if ci is None]
+
+        results = await self.direct_chunks(chunks, dirty, payload)
+        failures = [result for result in results if not result.get("validated")]
+        if results and len(failures) == len(chunks):
+            # Ningún fragmento tiene dirección: se devuelve el error en vez de un análisis inventado
+            first = failures[0]
+            response = {"content": None}
+            for key in ("error", "validation_error", "overloaded", "retry_after"):
+                if key in first:
+                    response[key] = first[key]
+            if "error" not in response and "validation_error" not in response:
+                response["error"] = "El modelo no devolvió dirección para ningún segmento"
+            return response
+
+        for i, result in zip(dirty, results):
+            if result.get("validated"):
+                directions[i] = json.loads(result["content"])
+            else:
+                # Solo el tipo de fallo: los mensajes de validación incluyen texto del guion
+                logger.warning(f"Segment {i + 1} direction failed: {'error' if result.get('error') else 'schema validation'}")
+                log_content("segment_direction_error", result.get("provider", ""), result.get("model", ""),
+                            result.get("error") or result.get("validation_error") or "")
+
+        response = self.merge(chunks, directions, wpm)
+        script_hash = self.states.put(
+            payload.get("project_id"), script, limits,
+            [chunk_units for chunk_units, _ in plan], directions
+        )
+        response["script_hash"] = script_hash
+        response["reused_segments"] = len(plan) - len(dirty)
+        response["analyzed_segments"] = len(dirty)
+        return response
+
+script_analyzer = ScriptAnalyzer()
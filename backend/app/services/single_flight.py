@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Deduplica llamadas concurrentes idénticas dentro del proceso.
+
+    La primera petición para una clave ejecuta la llamada real; las que llegan
+    mientras está en vuelo esperan el mismo resultado en lugar de disparar
+    otra petición al proveedor.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Peticiones esperando cada clave, incluida la que inició la llamada
+        self._waiters: Dict[str, int] = {}
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Ejecuta fn una sola vez por clave en vuelo y comparte su resultado."""
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.shared += 1
+        else:
+            # La llamada corre en su propia task: si quien la inició se cancela
+            # (p. ej. un cliente de /batch que se desconecta) sigue para el resto
+            task = asyncio.get_running_loop().create_task(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        self._waiters[key] += 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            # Si la task ya terminó, _forget ya limpió la clave
+            if not task.done():
+                self._waiters[key] -= 1
+                # Nadie más espera el resultado: no tiene sentido seguir la llamada
+                if self._waiters[key] == 0:
+                    task.cancel()
+        return {**result, "coalesced": True} if coalesced else result
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Evita el warning de excepción nunca recuperada si no hay esperas
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """Claves en vuelo con su cantidad de peticiones esperando."""
+        return {
+            "inflight": len(self._inflight),
+            "waiters": dict(self._waiters),
+            "shared_total": self.shared,
+        }
+
+single_flight = SingleFlight()
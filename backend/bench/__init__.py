@@ -0,0 +1 @@
+"""Benchmarks y pruebas de carga offline del backend (ver bench/README.md)."""
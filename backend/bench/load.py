@@ -0,0 +1,143 @@
+"""
+Generador de carga concurrente contra /prompt/{category}/{name}.
+
+Mide latencia de extremo a extremo por petición y reporta throughput,
+p50/p95/p99 y la distribución de estados. Sirve contra un backend real o
+contra uno apuntado al proveedor simulado (ver bench.run).
+
+Uso (desde backend/):
+    python -m bench.load --url http://127.0.0.1:8000 --requests 500 --concurrency 32
+"""
+import time
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, Optional
+
+import httpx
+
+from bench.mock_llm import load_fixture
+from bench.results import summarize, save_results
+
+def default_payload() -> Dict[str, Any]:
+    fixture = load_fixture("script")
+    return {
+        "SCRIPT": fixture["script"],
+        "segment_minTime": fixture["segment_minTime"],
+        "segment_maxTime": fixture["segment_maxTime"],
+        "segment_RateWpm": fixture["segment_RateWpm"],
+        "send_to_ai": True,
+    }
+
+async def run_load(
+    base_url: str,
+    category: str = "tasks",
+    name: str = "SCRIPT_ANALYZER",
+    requests: int = 200,
+    concurrency: int = 16,
+    payload: Optional[Dict[str, Any]] = None,
+    unique: bool = True,
+    bypass_cache: bool = False,
+    timeout: float = 120.0
+) -> Dict[str, Any]:
+    """
+    Lanza `requests` peticiones con `concurrency` workers.
+
+    Con unique=True cada petición lleva un sufijo distinto en el guion, así no
+    se sirven desde la cache de respuestas ni se agrupan con single-flight.
+    """
+    payload = payload or default_payload()
+    url = f"{base_url.rstrip('/')}/prompt/{category}/{name}"
+    latencies = []
+    statuses: Counter = Counter()
+    outcomes: Counter = Counter()
+    counter = iter(range(requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def worker():
+            for i in counter:
+                body = dict(payload)
+                if unique and "SCRIPT" in body:
+                    body["SCRIPT"] = f"{body['SCRIPT']}\n({i})"
+                if bypass_cache:
+                    body["bypass_cache"] = True
+                t0 = time.perf_counter()
+                try:
+                    response = await client.post(url, json=body)
+                except httpx.HTTPError as e:
+                    latencies.append(time.perf_counter() - t0)
+                    statuses["transport_error"] += 1
+                    outcomes[type(e).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - t0)
+                statuses[str(response.status_code)] += 1
+                outcomes[classify(response)] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "requests": requests,
+        "concurrency": concurrency,
+        "unique": unique,
+        "bypass_cache": bypass_cache,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "statuses": dict(statuses),
+        "outcomes": dict(outcomes),
+    }
+
+def classify(response: httpx.Response) -> str:
+    """Resultado lógico de una respuesta: validated, cache_hit, error, overloaded..."""
+    if response.status_code == 503:
+        return "overloaded"
+    if response.status_code >= 400:
+        return "http_error"
+    try:
+        body = response.json()
+    except ValueError:
+        return "invalid_json"
+    if body.get("error"):
+        return "error"
+    ai_response = body.get("ai_response") or {}
+    if ai_response.get("error"):
+        return "ai_error"
+    if ai_response.get("validation_error"):
+        return "validation_error"
+    if body.get("cache") == "hit":
+        return "cache_hit"
+    return "validated" if ai_response.get("validated") else "ok"
+
+def print_report(result: Dict[str, Any]):
+    lat = result["latency_ms"]
+    print(f"{result['url']}  n={result['requests']} c={result['concurrency']}")
+    print(f"  throughput: {result['throughput_rps']} req/s en {result['elapsed_seconds']}s")
+    print(f"  latencia ms: p50={lat.get('p50')} p95={lat.get('p95')} p99={lat.get('p99')} max={lat.get('max')}")
+    print(f"  estados: {result['statuses']}  resultados: {result['outcomes']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /prompt/{category}/{name}.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--category", default="tasks")
+    parser.add_argument("--name", default="SCRIPT_ANALYZER")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat-payload", action="store_true", help="Envía siempre el mismo payload (mide la cache)")
+    parser.add_argument("--bypass-cache", action="store_true")
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(
+        args.url, args.category, args.name, args.requests, args.concurrency,
+        unique=not args.repeat_payload, bypass_cache=args.bypass_cache
+    ))
+    print_report(result)
+    print(f"Resultados: {save_results('load', result, args.output)}")
+
+if __name__ == "__main__":
+    main()
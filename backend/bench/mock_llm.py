@@ -0,0 +1,177 @@
+"""
+Proveedor LLM simulado, compatible con la API de chat de OpenAI/DeepSeek.
+
+Permite medir el backend sin red ni API keys: latencia configurable por
+distribución, streaming SSE, inyección de 429 y respuestas fijas que cumplen
+los schemas del repo (SCRIPT_ANALYSIS y SEGMENT_DIRECTION).
+
+Uso:
+    python -m bench.mock_llm --port 9100 --latency lognormal:0.8:0.4 --rate-429 0.02
+
+y arrancar el backend con DEEPSEEK_BASE_URL=http://127.0.0.1:9100/v1.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class LatencyModel:
+    """
+    Distribución de latencia en segundos a partir de una especificación:
+    "fixed:0.5", "uniform:0.2:1.5" o "lognormal:<mediana>:<sigma>".
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Distribución de latencia desconocida: {kind}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return random.lognormvariate(0, sigma) * median
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        rate_429: float = 0.0,
+        token_delay: float = 0.0,
+        chunk_chars: int = 16,
+        seed: Optional[int] = None
+    ):
+        self.latency = LatencyModel(latency)
+        self.rate_429 = rate_429
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        if seed is not None:
+            random.seed(seed)
+
+def load_fixture(name: str) -> Dict[str, Any]:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def fixture_text(name: str) -> str:
+    return json.dumps(load_fixture(name), ensure_ascii=False)
+
+def canned_content(messages: List[Dict[str, Any]]) -> str:
+    """Elige la respuesta fija según el schema que pide el prompt."""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "ShortFormSegmentDirection" in prompt:
+        return fixture_text("segment_direction")
+    if "ShortFormScriptAnalysis" in prompt:
+        return fixture_text("script_analysis")
+    return json.dumps({"ok": True}, ensure_ascii=False)
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="VRM mock LLM")
+    app.state.requests = 0
+    app.state.rejected = 0
+
+    def usage(messages: List[Dict[str, Any]], content: str) -> Dict[str, int]:
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if config.rate_429 and random.random() < config.rate_429:
+            app.state.rejected += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                headers={"Retry-After": "1"}
+            )
+
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+        content = canned_content(messages)
+        completion_id = f"chatcmpl-mock-{app.state.requests}"
+        created = int(time.time())
+        await asyncio.sleep(config.latency.sample())
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage(messages, content),
+            }
+
+        async def events():
+            size = max(1, config.chunk_chars)
+            for i in range(0, len(content), size):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + size]}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if config.token_delay:
+                    await asyncio.sleep(config.token_delay)
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "rejected": app.state.rejected}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Proveedor LLM simulado (API compatible con OpenAI).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:MIN:MAX | lognormal:MEDIANA:SIGMA")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fracción de peticiones que responden 429")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Pausa entre chunks en streaming (s)")
+    parser.add_argument("--chunk-chars", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = MockConfig(args.latency, args.rate_429, args.token_delay, args.chunk_chars, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import json
+import math
+import time
+import platform
+import subprocess
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil q (0-100) por interpolación lineal sobre valores ya ordenados."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return sorted_values[lo]
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(samples: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """Resumen de latencias (por defecto de segundos a milisegundos)."""
+    values = sorted(s * scale for s in samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "min": round(values[0], 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(values[-1], 4),
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(RESULTS_DIR), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(kind: str, data: Dict[str, Any], path: Optional[str] = None) -> str:
+    """Guarda los resultados en JSON con la revisión de git y datos del entorno."""
+    revision = git_revision()
+    document = {
+        "kind": kind,
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": data,
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(RESULTS_DIR, f"{kind}-{revision or 'norev'}-{stamp}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    return path
@@ -0,0 +1,131 @@
+"""
+Suite completa offline: levanta el proveedor simulado y el backend apuntado a
+él, corre los microbenchmarks y los escenarios de carga y guarda un único JSON.
+
+Uso (desde backend/):
+    python -m bench.run
+    python -m bench.run --latency lognormal:0.3:0.5 --rate-429 0.05 --requests 1000
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import httpx
+
+from bench import microbench
+from bench.load import run_load, print_report
+from bench.results import save_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El servicio no respondió a tiempo: {url}")
+
+@contextmanager
+def process(args: List[str], env: Dict[str, str], health_url: str) -> Iterator[subprocess.Popen]:
+    proc = subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(health_url)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def backend_env(mock_url: str, extra: Dict[str, str]) -> Dict[str, str]:
+    """Entorno del backend: solo el proveedor simulado, sin claves reales."""
+    env = dict(os.environ)
+    for key in ("OPENAI_API_KEY", "OPENAI_BASE_URL"):
+        env.pop(key, None)
+    env.update({
+        "DEEPSEEK_API_KEY": "sk-mock",
+        "DEEPSEEK_BASE_URL": f"{mock_url}/v1",
+        "AI_SECONDARY_ROUTE": "",
+        "RESPONSE_CACHE_SQLITE": "",
+        "LOG_LEVEL": "WARNING",
+        "LOG_SAMPLE_RATE": "0",
+    })
+    env.update(extra)
+    return env
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline del backend con proveedor simulado.")
+    parser.add_argument("--latency", default="lognormal:0.05:0.5", help="Latencia del proveedor simulado")
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=1000, help="Iteraciones de los microbenchmarks")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    args = parser.parse_args()
+
+    results: Dict[str, object] = {
+        "config": {
+            "latency": args.latency,
+            "rate_429": args.rate_429,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        }
+    }
+
+    if not args.skip_micro:
+        print("== Microbenchmarks")
+        logging.basicConfig(level=logging.ERROR)
+        results["micro"] = microbench.run(args.iterations)
+
+    mock_port, backend_port = free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    mock_args = [
+        sys.executable, "-m", "bench.mock_llm", "--port", str(mock_port),
+        "--latency", args.latency, "--rate-429", str(args.rate_429), "--seed", str(args.seed)
+    ]
+    backend_args = [
+        sys.executable, "-m", "uvicorn", "main:app", "--port", str(backend_port),
+        "--log-level", "warning", "--no-access-log"
+    ]
+
+    scenarios = [
+        ("unique", {"unique": True}),
+        ("repeated_payload", {"unique": False}),
+    ]
+    load_results = {}
+    with process(mock_args, dict(os.environ), f"{mock_url}/stats"):
+        with process(backend_args, backend_env(mock_url, {}), f"{backend_url}/stats"):
+            for name, options in scenarios:
+                print(f"== Carga: {name}")
+                result = asyncio.run(run_load(
+                    backend_url, requests=args.requests, concurrency=args.concurrency, **options
+                ))
+                print_report(result)
+                load_results[name] = result
+            load_results["backend_stats"] = httpx.get(f"{backend_url}/stats").json()
+        load_results["mock_stats"] = httpx.get(f"{mock_url}/stats").json()
+    results["load"] = load_results
+
+    print(f"Resultados: {save_results('suite', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from app.core.segmentation import count_words, pack_units, plan_incremental, split_script, split_units
+
+# Con 60 WPM cada segundo equivale a una palabra
+WPM = 60.0
+
+MIN_WORDS, MAX_WORDS = 6, 10
+
+SCRIPT = (
+    "Uno dos tres cuatro cinco. Seis siete ocho nueve diez. "
+    "Once doce trece catorce quince. Dieciseis diecisiete dieciocho diecinueve veinte. "
+    "Veintiuno veintidos veintitres veinticuatro veinticinco. Veintiseis veintisiete veintiocho veintinueve treinta."
+)
+
+
+def chunk_words(chunk):
+    return sum(count_words(unit) for unit in chunk)
+
+
+def previous_analysis():
+    units = split_units(SCRIPT, MAX_WORDS)
+    return units, pack_units(units, MIN_WORDS, MAX_WORDS)
+
+
+def assert_covers(plan, units):
+    """El plan mantiene todas las unidades nuevas, en orden y sin duplicados."""
+    assert [unit for chunk, _ in plan for unit in chunk] == units
+
+
+
+def test_long_sentence_is_cut_by_clause_then_word():
+    chunks = split_script("Corta. Uno dos tres, cuatro cinco seis siete ocho.", 0, 3, WPM)
+    assert chunks == ["Corta.", "Uno dos tres,", "cuatro cinco seis", "siete ocho."]
+    assert all(count_words(chunk) <= 3 for chunk in chunks)
+
+
+def test_respects_max_words():
+    chunks = split_script("a b c d. e f. g h i j k l m n.", 5, 8, WPM)
+    assert chunks == ["a b c d. e f.", "g h i j k l m n."]
+
+
+def test_short_tail_takes_units_from_previous():
+    # [4 + 4] + [1]: el último no entra junto al anterior, así que le toma una oración
+    chunks = split_script("a b c d. e f g h. i.", 3, 8, WPM)
+    assert chunks == ["a b c d.", "e f g h. i."]
+    assert all(3 <= count_words(chunk) <= 8 for chunk in chunks)
+
+
+def test_short_chunk_is_merged_when_it_fits():
+    assert split_script("a b c d e f. g h.", 4, 8, WPM) == ["a b c d e f. g h."]
+
+
+def test_every_word_is_kept_in_order():
+    text = "Primera oración del guion. Segunda, con una coma. Tercera y última frase del texto."
+    chunks = split_script(text, 2, 5, WPM)
+    assert ' '.join(chunks).split() == text.split()
+    assert all(count_words(chunk) <= 5 for chunk in chunks)
+
+
+def test_unchanged_script_reuses_every_chunk():
+    units, chunks = previous_analysis()
+    plan = plan_incremental(chunks, units, MIN_WORDS, MAX_WORDS)
+    assert [ci for _, ci in plan] == [0, 1, 2]
+    assert_covers(plan, units)
+
+
+def test_edit_in_the_middle_only_reanalyzes_that_chunk():
+    units, chunks = previous_analysis()
+    edited = list(units)
+    edited[2] = "Once doce TRECE catorce quince."
+    plan = plan_incremental(chunks, edited, MIN_WORDS, MAX_WORDS)
+    assert [ci for _, ci in plan] == [0, None, 2]
+    assert plan[1][0] == [edited[2], edited[3]]
+    assert_covers(plan, edited)
+
+
+def test_edit_at_the_start_keeps_following_chunks():
+    units, chunks = previous_analysis()
+    edited = list(units)
+    edited[0] = "Cero uno dos tres cuatro cinco."
+    plan = plan_incremental(chunks, edited, MIN_WORDS, MAX_WORDS)
+    assert [ci for _, ci in plan if ci is not None] == [1, 2]
+    assert all(ci is None for _, ci in plan[:-2])
+    assert all(chunk_words(chunk) <= MAX_WORDS for chunk, _ in plan)
+    assert_covers(plan, edited)
+
+
+def test_edit_at_the_end_keeps_previous_chunks():
+    units, chunks = previous_analysis()
+    edited = units[:-1] + ["Fin del guion de prueba."]
+    plan = plan_incremental(chunks, edited, MIN_WORDS, MAX_WORDS)
+    assert [ci for _, ci in plan] == [0, 1, None]
+    assert_covers(plan, edited)
+
+
+def test_deleted_chunk_is_dropped_and_neighbours_reused():
+    units, chunks = previous_analysis()
+    edited = units[:2] + units[4:]
+    plan = plan_incremental(chunks, edited, MIN_WORDS, MAX_WORDS)
+    assert [ci for _, ci in plan] == [0, 2]
+    assert_covers(plan, edited)
+
+
+def test_short_edited_region_absorbs_next_chunk_within_limits():
+    units = ["a b c.", "d e f.", "g h i.", "j k l.", "m n o.", "p q r."]
+    chunks = pack_units(units, 4, 9)
+    assert chunks == [units[0:3], units[3:6]]
+
+    # La primera región queda en 2 palabras (< min): absorbe al fragmento
+    # siguiente y el conjunto (11 palabras) se vuelve a segmentar
+    edited = ["x y."] + units[3:]
+    plan = plan_incremental(chunks, edited, 4, 9)
+    assert plan == [(["x y.", "j k l."], None), (["m n o.", "p q r."], None)]
+    assert all(4 <= chunk_words(chunk) <= 9 for chunk, _ in plan)
+
+
+def test_short_trailing_region_merges_into_previous_chunk():
+    units = ["a b c.", "d e f.", "g h i.", "j k l.", "m n o.", "p q r."]
+    chunks = pack_units(units, 4, 9)
+
+    edited = units[:3] + ["z."]
+    plan = plan_incremental(chunks, edited, 4, 9)
+    assert plan == [(["a b c.", "d e f."], None), (["g h i.", "z."], None)]
+    assert all(4 <= chunk_words(chunk) <= 9 for chunk, _ in plan)
+
+
+def test_reuse_requires_contiguous_units():
+    units = ["a b c.", "d e f.", "g h i.", "j k l.", "m n o.", "p q r."]
+    chunks = pack_units(units, 4, 9)
+
+    # Se inserta una unidad dentro del segundo fragmento: ya no es contiguo
+    edited = units[:4] + ["nueva frase aquí."] + units[4:]
+    plan = plan_incremental(chunks, edited, 4, 9)
+    assert plan[0] == (units[:3], 0)
+    assert all(ci is None for _, ci in plan[1:])
+    assert all(chunk_words(chunk) <= 9 for chunk, _ in plan)
+    assert_covers(plan, edited)
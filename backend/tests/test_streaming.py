@@ -0,0 +1,53 @@
+import json
+
+from app.core.streaming import SegmentStreamParser
+
+DOCUMENT = {
+    "title": "segments",
+    "language": "es",
+    "segments": [
+        {"text": "Hola {mundo}", "direction": {"tone": "cálido"}},
+        {"text": "Dijo \"basta\" y se fue", "tags": ["a", "b]"]},
+        {"text": "Barra invertida \\\\ al final\\\\"},
+    ],
+    "summary": {"segments": [{"ignored": True}]},
+}
+
+
+def feed_in_chunks(parser, text, size):
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(parser.feed(text[i:i + size]))
+    return items
+
+
+def test_whole_document_in_one_chunk():
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+    assert SegmentStreamParser().feed(text) == DOCUMENT["segments"]
+
+
+def test_segments_split_across_token_boundaries():
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+    for size in (1, 2, 3, 7, 16):
+        parser = SegmentStreamParser()
+        assert feed_in_chunks(parser, text, size) == DOCUMENT["segments"], size
+        assert parser.text == text
+
+
+def test_item_emitted_as_soon_as_it_closes():
+    parser = SegmentStreamParser()
+    assert parser.feed('{"segments": [{"text": "uno"') == []
+    assert parser.feed('}, {"text": ') == [{"text": "uno"}]
+    assert parser.feed('"dos"}') == [{"text": "dos"}]
+    assert parser.feed(']}') == []
+
+
+def test_nested_array_with_same_key_is_ignored():
+    parser = SegmentStreamParser()
+    text = '{"meta": {"segments": [{"x": 1}]}, "segments": [{"y": 2}]}'
+    assert feed_in_chunks(parser, text, 5) == [{"y": 2}]
+
+
+def test_custom_array_key():
+    parser = SegmentStreamParser(array_key="items")
+    assert parser.feed('{"segments": [{"a": 1}], "items": [{"b": 2}]}') == [{"b": 2}]
@@ -1,3 +1,4 @@
+import os
 import requests
 import json
 
@@ -44,7 +45,9 @@ class ScriptFragmentationAgent:
 
 # Ejemplo de uso (para testing manual)
 if __name__ == "__main__":
-    API_KEY = "sk-d3c168f012274a29bd93617498c4e219"
+    API_KEY = os.getenv("DEEPSEEK_API_KEY")
+    if not API_KEY:
+        raise SystemExit("Definí DEEPSEEK_API_KEY en el entorno")
     TEST_TEXT = """
     ¿Alguna vez has sentido que tus videos no conectan? El problema no es tu cámara ni tu micrófono, sino la forma en que estructuras tu mensaje. Hoy te voy a enseñar 3 pasos infalibles para retener la atención de tu audiencia desde el primer segundo. Primero, define un solo objetivo claro. Segundo, usa subtítulos dinámicos. Y tercero, asegúrate de mirar siempre al lente, no a la pantalla. Si aplicas esto hoy mismo, verás la diferencia en tus métricas. Sígueme para más consejos de creación de contenido.
     """